@@ -0,0 +1,48 @@
+import asyncio
+import logging
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class AckAggregator:
+    """
+    Накапливает ID обработанных (или пропущенных) сообщений и подтверждает их в
+    почтовом ящике пачками: при наборе ACK_BATCH_SIZE сообщений или раз в
+    ACK_FLUSH_INTERVAL секунд. Не подтвержденные из-за ошибки ID остаются в очереди
+    до следующего сброса.
+    """
+
+    def __init__(self, source, batch_size=None, flush_interval=None):
+        self.source = source
+        self.batch_size = min(batch_size or Config.ACK_BATCH_SIZE, 1000)  # лимит batchModify
+        self.flush_interval = flush_interval or Config.ACK_FLUSH_INTERVAL
+        self.pending = {}  # dict как упорядоченное множество ID
+        self.lock = asyncio.Lock()
+
+    async def add(self, msg_id):
+        self.pending[msg_id] = None
+        if len(self.pending) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        """Подтверждает накопленные сообщения; возвращает False, если часть осталась в очереди"""
+        async with self.lock:
+            while self.pending:
+                batch = list(self.pending)[:self.batch_size]
+                if not await self.source.acknowledge_many(batch):
+                    logger.error("Не удалось подтвердить %s сообщений, повторим позже", len(batch))
+                    return False
+                for msg_id in batch:
+                    self.pending.pop(msg_id, None)
+                logger.info("Подтверждено сообщений: %s", len(batch))
+            return True
+
+    async def run(self):
+        """Фоновый сброс по таймеру"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Ошибка при подтверждении сообщений: %s", e)
@@ -0,0 +1,153 @@
+"""
+Генератор синтетических банковских писем для проверки и замеров парсеров TelegramClient.
+
+Корпус детерминирован: одинаковые seed и count всегда дают одинаковые письма.
+Каждое письмо помечено ожидаемым типом (kind), совпадающим с типами parse_message.
+"""
+import random
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+KINDS = ('incoming', 'sbp', 'card', 'payment', 'unknown')
+FORMATS = ('html', 'plain')
+
+_COMPANIES = [
+    'ООО "ДНС РИТЕЙЛ"', 'ФИЛИАЛ ПРИВОЛЖСКИЙ ООО "ДНС РИТЕЙЛ"', 'АО "Тандер"',
+    'ООО "Ромашка"', 'ПАО "Ростелеком"', 'ООО "Яндекс"', 'ИП Кузнецова Ольга Сергеевна',
+]
+_FIRST_NAMES = ['Андрей', 'Виталий', 'Ольга', 'Руслан', 'Мария', 'Сергей', 'Екатерина']
+_MIDDLE_NAMES = ['Владимирович', 'Иванович', 'Сергеевна', 'Петрович', 'Андреевна']
+_LAST_NAMES = ['Рязанцев', 'Смирнов', 'Петров', 'Иванов', 'Соколов', 'Попов']
+_BANKS = ['Озон Банк (Ozon)', 'Сбербанк', 'Т-Банк', 'Альфа-Банк', 'ВТБ']
+_PLACES = ['VB24', 'PYATEROCHKA', 'YANDEX.TAXI', 'OZON', 'AZS LUKOIL']
+_CARD_OPERATIONS = ['Снятие', 'Пополнение', 'Оплата']
+_PURPOSES = [
+    'Оплата по счету № RN{num} от {date} Без НДС',
+    'Оплата по договору {num} от {date}, в т.ч. НДС 20%',
+    'Возврат излишне уплаченных средств по счету {num}',
+]
+_NEWSLETTERS = [
+    'Уважаемый клиент!\nС {date} изменяются тарифы на обслуживание.\nПодробности в приложении.',
+    'Выписка по счёту за период до {date} сформирована.\nОна доступна в интернет-банке.',
+    'Напоминаем о плановых работах {date}.\nВ это время возможны перебои в работе приложения.',
+]
+
+
+def _amount(rng, low=100, high=3_000_000, kopecks=True):
+    value = rng.randint(low, high)
+    text = f"{value:,}".replace(',', ' ')
+    if kopecks and rng.random() < 0.5:
+        text += f",{rng.randint(0, 99):02d}"
+    return text
+
+
+def _account(rng):
+    return '40802810' + ''.join(str(rng.randint(0, 9)) for _ in range(12))
+
+
+def _person(rng, with_ip=False):
+    name = f"{rng.choice(_LAST_NAMES)} {rng.choice(_FIRST_NAMES)} {rng.choice(_MIDDLE_NAMES)}"
+    return f"ИП {name}" if with_ip else name
+
+
+def _date(rng):
+    return (datetime(2025, 1, 1) + timedelta(days=rng.randint(0, 364))).strftime('%d.%m.%Y')
+
+
+def _incoming(rng):
+    return [
+        f"Зачислен платёж №{rng.randint(1, 99999)} на {_amount(rng)} RUB на счёт {_account(rng)}",
+        f"Отправитель — {rng.choice(_COMPANIES)}, ИНН {rng.randint(10 ** 9, 10 ** 10 - 1)}",
+        f"Назначение — {rng.choice(_PURPOSES).format(num=rng.randint(1, 9999), date=_date(rng))}",
+        f"Доступно на счёте — {_amount(rng)} RUB",
+    ]
+
+
+def _sbp(rng):
+    first = rng.choice(_FIRST_NAMES)
+    return [
+        f"Мы отправили {_amount(rng, 100, 300_000, kopecks=False)} ₽ через Систему быстрых платежей",
+        f"по номеру телефона +7 9{rng.randint(10, 99)} ***-**-{rng.randint(10, 99)}",
+        f"Получатель — {first} {rng.choice(_MIDDLE_NAMES)} {rng.choice(_LAST_NAMES)[0]}.",
+        f"Банк получателя — {rng.choice(_BANKS)}",
+    ]
+
+
+def _card(rng):
+    return [
+        f"Карта *{rng.randint(1000, 9999)}",
+        f"{rng.choice(_CARD_OPERATIONS)} {_amount(rng, 100, 500_000)} р в {rng.choice(_PLACES)}",
+        f"Остаток {_amount(rng)} р",
+    ]
+
+
+def _payment(rng):
+    return [
+        f"Платёж №{rng.randint(1, 99999)} на — {_amount(rng)} RUB со счёта {_account(rng)[:12]} исполнен",
+        f"Получатель — {_person(rng, with_ip=rng.random() < 0.5)}, ИНН {rng.randint(10 ** 9, 10 ** 10 - 1)}",
+        f"Назначение — {rng.choice(_PURPOSES).format(num=rng.randint(1, 9999), date=_date(rng))}",
+        f"На счёте — {_amount(rng)} RUB",
+        f"Время отправки — {_date(rng)} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d} (МСК)",
+    ]
+
+
+def _unknown(rng):
+    return rng.choice(_NEWSLETTERS).format(date=_date(rng)).split('\n')
+
+
+_BUILDERS = {
+    'incoming': _incoming,
+    'sbp': _sbp,
+    'card': _card,
+    'payment': _payment,
+    'unknown': _unknown,
+}
+
+_SUBJECTS = {
+    'incoming': 'Зачисление на счёт',
+    'sbp': 'Перевод по СБП',
+    'card': 'Операция по карте',
+    'payment': 'Платёж исполнен',
+    'unknown': 'Информация от банка',
+}
+
+
+def _to_html(rng, lines):
+    """Оборачивает строки в типовую банковскую HTML-верстку с мусорными элементами"""
+    rows = ''.join(
+        f'<tr><td style="padding:4px">{line.replace(" ", "&nbsp;", 1)}</td></tr>\n' for line in lines
+    )
+    return (
+        '<html><head><meta charset="utf-8"><title>Банк</title>'
+        '<style>td{font-family:Arial}</style></head><body>'
+        '<script>var t=1;</script>'
+        f'<table width="600"><tr><td></td></tr>\n{rows}</table>'
+        f'<p><span>​</span></p><div>Это письмо сформировано автоматически, '
+        f'№ {rng.randint(10 ** 5, 10 ** 6)}</div></body></html>'
+    )
+
+
+def generate_message(rng, index, kind=None, fmt=None):
+    kind = kind or rng.choice(KINDS)
+    fmt = fmt or rng.choice(FORMATS)
+    lines = _BUILDERS[kind](rng)
+    body = _to_html(rng, lines) if fmt == 'html' else '\n'.join(lines)
+    sent = datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=rng.randint(0, 365 * 86400))
+    return {
+        'kind': kind,
+        'format': fmt,
+        'details': {
+            'id': f'synthetic-{index:06d}',
+            'subject': _SUBJECTS[kind],
+            'from': 'noreply@bank.example',
+            'date': format_datetime(sent),
+            'body': body,
+            'attachments': [],
+        },
+    }
+
+
+def generate_corpus(count, seed=1):
+    """Генерирует count писем; типы и форматы распределены равномерно"""
+    rng = random.Random(seed)
+    return [generate_message(rng, index) for index in range(count)]
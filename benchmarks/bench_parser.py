@@ -0,0 +1,138 @@
+"""
+Замер скорости TelegramClient.format_message на синтетическом корпусе и сверка с эталоном.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_parser                  # замер + сверка с эталоном
+    python -m benchmarks.bench_parser --count 20000    # замер на большом корпусе
+    python -m benchmarks.bench_parser --update-golden  # перезаписать эталон после намеренных изменений
+
+Эталон (parser_golden.json) хранит результаты форматирования для корпуса с seed и count
+по умолчанию. Любое ускорение парсеров должно проходить сверку без изменения эталона.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+# TelegramClient читает Config при импорте; для замеров реальные токены не нужны
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '0:benchmark')
+os.environ.setdefault('TELEGRAM_GROUP_ID', '0')
+os.environ.setdefault('LABEL_TO_THREAD_MAPPING', '{}')
+
+from benchmarks.bank_corpus import generate_corpus  # noqa: E402
+from telegram_client import TelegramClient  # noqa: E402
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), 'parser_golden.json')
+GOLDEN_SEED = 1
+GOLDEN_COUNT = 250
+
+
+def measure_throughput(client, corpus, repeat):
+    """Возвращает число сообщений в секунду (лучший из repeat прогонов)"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in corpus:
+            client.format_message(item['details'])
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(corpus) / best
+
+
+def measure_memory(client, corpus):
+    """Пиковый объем памяти, выделяемой при форматировании одного сообщения (байт)"""
+    peaks = []
+    tracemalloc.start()
+    try:
+        for item in corpus:
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            client.format_message(item['details'])
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - baseline)
+    finally:
+        tracemalloc.stop()
+    return sum(peaks) / len(peaks), max(peaks)
+
+
+def check_classification(client, corpus):
+    """Сравнивает тип, определенный parse_message, с типом, заложенным генератором"""
+    mismatches = Counter()
+    for item in corpus:
+        parsed = client.parse_message(item['details'])
+        actual = parsed['type'] if parsed else None
+        if actual != item['kind']:
+            mismatches[(item['kind'], item['format'], actual)] += 1
+    return mismatches
+
+
+def check_golden(client):
+    corpus = generate_corpus(GOLDEN_COUNT, GOLDEN_SEED)
+    with open(GOLDEN_PATH, encoding='utf-8') as f:
+        golden = json.load(f)
+    failures = []
+    for item in corpus:
+        msg_id = item['details']['id']
+        actual = client.format_message(item['details'])
+        if golden.get(msg_id) != actual:
+            failures.append((msg_id, golden.get(msg_id), actual))
+    return failures
+
+
+def update_golden(client):
+    corpus = generate_corpus(GOLDEN_COUNT, GOLDEN_SEED)
+    golden = {item['details']['id']: client.format_message(item['details']) for item in corpus}
+    with open(GOLDEN_PATH, 'w', encoding='utf-8') as f:
+        json.dump(golden, f, ensure_ascii=False, indent=1, sort_keys=True)
+        f.write('\n')
+    print(f"Эталон обновлен: {len(golden)} сообщений -> {GOLDEN_PATH}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=2000, help='размер корпуса для замера')
+    parser.add_argument('--seed', type=int, default=GOLDEN_SEED)
+    parser.add_argument('--repeat', type=int, default=3, help='число прогонов, берется лучший')
+    parser.add_argument('--update-golden', action='store_true')
+    args = parser.parse_args()
+
+    client = TelegramClient()
+    if args.update_golden:
+        update_golden(client)
+        return 0
+
+    corpus = generate_corpus(args.count, args.seed)
+    by_kind = Counter(item['kind'] for item in corpus)
+    print(f"Корпус: {len(corpus)} писем, seed={args.seed}, " +
+          ', '.join(f"{kind}={count}" for kind, count in sorted(by_kind.items())))
+
+    throughput = measure_throughput(client, corpus, args.repeat)
+    print(f"format_message: {throughput:,.0f} сообщений/сек ({1e6 / throughput:.1f} мкс на сообщение)")
+
+    mean_peak, max_peak = measure_memory(client, corpus)
+    print(f"Память на сообщение: в среднем {mean_peak / 1024:.1f} КиБ, максимум {max_peak / 1024:.1f} КиБ")
+
+    status = 0
+    mismatches = check_classification(client, corpus)
+    if mismatches:
+        status = 1
+        print("Неверно определен тип сообщения:")
+        for (kind, fmt, actual), count in sorted(mismatches.items(), key=str):
+            print(f"  ожидался {kind} ({fmt}), получен {actual}: {count}")
+
+    failures = check_golden(client)
+    if failures:
+        status = 1
+        print(f"Расхождения с эталоном: {len(failures)} из {GOLDEN_COUNT}")
+        for msg_id, expected, actual in failures[:5]:
+            print(f"  {msg_id}:\n    ожидалось: {expected!r}\n    получено:  {actual!r}")
+    else:
+        print(f"Сверка с эталоном: {GOLDEN_COUNT} из {GOLDEN_COUNT} совпадают")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+Сравнение HTTP-транспорта TelegramClient с исходной настройкой HTTPXRequest(connection_pool_size=20)
+на локальном поддельном Bot API сервере.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_telegram
+    python -m benchmarks.bench_telegram --messages 500 --idle 8 --latency 20
+
+Замеряется:
+- задержка первой отправки после простоя дольше keepalive по умолчанию в httpx (5 с);
+- пропускная способность пачки параллельных отправок.
+
+Сервер работает по обычному HTTP, поэтому HTTP/2 (согласуется через ALPN в TLS) здесь не
+используется: замер показывает выигрыш от предварительного подключения и keep-alive.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+import time
+
+from aiohttp import web
+
+# TelegramClient читает Config при импорте; для замеров реальные токены не нужны
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '0:benchmark')
+os.environ.setdefault('TELEGRAM_GROUP_ID', '-1000000000000')
+os.environ.setdefault('LABEL_TO_THREAD_MAPPING', '{}')
+os.environ['TELEGRAM_HTTP2'] = 'false'
+
+HOST = '127.0.0.1'
+
+
+class FakeBotApi:
+    """Минимальный Bot API: getMe и sendMessage с настраиваемой задержкой ответа"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.message_ids = itertools.count(1)
+        self.peers = set()  # адреса клиентов = открытые к серверу TCP-соединения
+        self.last_peer = None
+
+    async def handle(self, request):
+        self.last_peer = request.transport.get_extra_info('peername')
+        self.peers.add(self.last_peer)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        method = request.match_info['method'].lower()
+        if method == 'getme':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        else:
+            data = await request.post()
+            result = {
+                'message_id': next(self.message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(data.get('chat_id', 0)), 'type': 'supergroup'},
+                'text': data.get('text', ''),
+            }
+        return web.json_response({'ok': True, 'result': result})
+
+    async def start(self, port):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, HOST, port)
+        await site.start()
+        return runner
+
+
+async def measure(name, bot, api, messages, idle, warm_up):
+    # Исходный транспорт тоже получает одно соединение заранее - первой обычной отправкой
+    if warm_up:
+        await warm_up()
+    else:
+        await bot.send_message(chat_id=-1, text='first', message_thread_id=1)
+    known_peers = set(api.peers)
+
+    await asyncio.sleep(idle)
+    start = time.perf_counter()
+    await bot.send_message(chat_id=-1, text='cold', message_thread_id=1)
+    cold = time.perf_counter() - start
+    reused = 'да' if api.last_peer in known_peers else 'нет'
+    api.peers.clear()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        bot.send_message(chat_id=-1, text=f'msg {index}', message_thread_id=1) for index in range(messages)
+    ))
+    elapsed = time.perf_counter() - start
+    print(f"{name:>10}: первая отправка после простоя {cold * 1000:.1f} мс "
+          f"(соединение переиспользовано: {reused}), {messages / elapsed:,.0f} сообщений/сек, "
+          f"соединений в пачке: {len(api.peers)}")
+
+
+async def run(args):
+    api = FakeBotApi(args.latency / 1000)
+    runner = await api.start(args.port)
+    base_url = f'http://{HOST}:{args.port}/bot'
+    os.environ['TELEGRAM_API_URL'] = base_url
+
+    from telegram import Bot
+    from telegram.request import HTTPXRequest
+    from telegram_client import TelegramClient
+
+    try:
+        baseline = Bot(token='0:benchmark', request=HTTPXRequest(connection_pool_size=20), base_url=base_url)
+        async with baseline:
+            await measure('исходный', baseline, api, args.messages, args.idle, None)
+
+        client = TelegramClient()
+        keep_alive = asyncio.create_task(client.keep_alive())
+        try:
+            await measure('новый', client.bot, api, args.messages, args.idle, client.warm_up)
+        finally:
+            keep_alive.cancel()
+            await client.bot.shutdown()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=200, help='размер пачки параллельных отправок')
+    parser.add_argument('--idle', type=float, default=6.0, help='простой перед первой отправкой, с')
+    parser.add_argument('--latency', type=float, default=5.0, help='задержка ответа сервера, мс')
+    parser.add_argument('--port', type=int, default=18081)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,28 +1,53 @@
 import time
 import asyncio
-from gmail_client import GmailClient
+import argparse
+from mail_source import create_mail_source
+from mail_import import ArchiveMailSource
+from message_cache import CachedMailSource
 from telegram_client import TelegramClient
 from config import Config, setup_logging
-from typing import Dict, Any
+from gmail_quota import PRIORITY_LIVE, PRIORITY_BACKFILL
+from message_dedup import ContentDeduplicator
+from routing import MessageRouter, label_names
+from config_watcher import ConfigWatcher
+from payment_store import PaymentStore, format_digest, seconds_until
+from ack_aggregator import AckAggregator
+from send_scheduler import SendScheduler, Delivery, LaneFull, LANE_LIVE, LANE_BACKFILL, LANE_RETRY
+from typing import Dict, Any, List
 from collections import defaultdict
 from datetime import datetime
 
 logger = setup_logging()
 
+RETRY_DELAY = 5  # секунд до повторной отправки
+
 
 class MailForwarderBot:
-    def __init__(self):
-        self.gmail = GmailClient()
+    def __init__(self, mail=None):
+        self.mail = mail or create_mail_source()
         self.telegram = TelegramClient()
         self.labels = list(Config.LABEL_TO_THREAD_MAPPING.keys())
         self.loop = asyncio.get_event_loop()
+        self.label_map = self.mail.get_label_map()
+        self.router = MessageRouter(Config.LABEL_TO_THREAD_MAPPING, Config.ROUTING_RULES, self.label_map)
         self._validate_labels()
+        self.config_watcher = ConfigWatcher(self.apply_config)
+        self.config_task = None
 
         self.processed_messages = set()
-        self.message_queue = asyncio.Queue()
+        self.dedup = ContentDeduplicator()
+        self.acks = AckAggregator(self.mail)
+        self.payments = PaymentStore() if Config.PAYMENTS_DB else None
+        self.digest_task = None
+        self.ack_task = None
+        self.message_queue = SendScheduler()
         self.last_send_times = defaultdict(lambda: datetime.min)
         self.sending_task = None
+        self.keepalive_task = None
+        self.backfill_task = None
         self.sending_lock = asyncio.Lock()
+        self.in_progress = set()  # ID сообщений, которые сейчас обрабатываются
+        self.pending_deliveries = {}  # ID сообщения -> число еще не доставленных топиков
 
         self.processed_messages = set()  # Для отслеживания уже обработанных сообщений
 
@@ -34,10 +59,11 @@ class MailForwarderBot:
     async def _message_sender_worker(self):
         """Фоновый процесс для отправки сообщений с интервалом"""
         while True:
+            lane, delivery = await self.message_queue.get()
+            thread_id = delivery.thread_id
+            logger.debug("Отправка из полосы %s в топик %s", lane, thread_id, extra={'thread_id': thread_id})
             try:
-                thread_id, formatted_msg = await self.message_queue.get()
-
-                async with self.sending_lock:
+                if not delivery.done:
                     # Вычисляем время ожидания
                     now = datetime.now()
                     last_send = self.last_send_times[thread_id]
@@ -45,98 +71,224 @@ class MailForwarderBot:
                     wait_time = max(0, 5 - time_since_last)
 
                     if wait_time > 0:
-                        await asyncio.sleep(wait_time)
+                        # Топик еще на паузе: элемент ждет в начале своей полосы, а worker
+                        # тем временем обслуживает другие полосы
+                        delivery.not_before = asyncio.get_running_loop().time() + wait_time
+                        self.message_queue.put_front_nowait(delivery, lane)
+                        continue
 
-                    # Отправляем сообщение
-                    message_sent = await self.telegram.send_message_to_thread(
-                        thread_id, formatted_msg
-                    )
-                    self.last_send_times[thread_id] = datetime.now()
+                    async with self.sending_lock:
+                        # За один выбор из очереди отправляется одна часть письма
+                        message_sent = await self._send_part(thread_id, delivery.parts[delivery.sent])
+                        self.last_send_times[thread_id] = datetime.now()
 
                     if not message_sent:
-                        # Если не удалось отправить, возвращаем в очередь
-                        await self.message_queue.put((thread_id, formatted_msg))
-                        await asyncio.sleep(5)  # Подождем перед повторной попыткой
+                        self._retry(delivery)
+                        continue
+                    delivery.sent += 1
+
+                if delivery.done:
+                    await self._delivered(delivery)
+                else:
+                    # Остальные части - в начало той же полосы: они уйдут следом, по порядку, но
+                    # живое письмо может пройти между частями длинного письма из истории
+                    self.message_queue.put_front_nowait(delivery, lane)
 
             except Exception as e:
-                logger.error(f"Ошибка в worker отправки сообщений: {e}")
+                logger.error("Ошибка в worker отправки сообщений: %s", e)
                 await asyncio.sleep(5)
-    def _validate_labels(self):
-        """Проверяет, существуют ли все указанные метки в Gmail"""
-        missing_labels = []
-        for label in self.labels:
-            if not self.gmail.get_label_id(label):
-                missing_labels.append(label)
+            finally:
+                self.message_queue.task_done()
+
+    def _retry(self, delivery):
+        """
+        Откладывает неотправленный элемент в полосу повторов на RETRY_DELAY секунд, пока не
+        исчерпан лимит попыток. Worker при этом не ждет и продолжает обслуживать другие полосы.
+        """
+        thread_id = delivery.thread_id
+        log_extra = {'msg_id': delivery.msg_id, 'thread_id': thread_id}
+        delivery.attempts += 1
+        if delivery.attempts > Config.SEND_MAX_RETRIES:
+            # Постоянная ошибка (слишком длинный текст, неверный топик) не должна блокировать очередь
+            logger.error(
+                "Сообщение %s для топика %s не отправлено после %s попыток, пропускаем",
+                delivery.msg_id, thread_id, delivery.attempts, extra=log_extra
+            )
+            # Письмо не подтверждаем: оно доставлено не во все топики
+            self.pending_deliveries.pop(delivery.msg_id, None)
+            return
+        delivery.not_before = asyncio.get_running_loop().time() + RETRY_DELAY
+        try:
+            self.message_queue.put_nowait(delivery, LANE_RETRY)
+        except LaneFull:
+            logger.error("Очередь повторов переполнена, сообщение для топика %s потеряно", thread_id, extra=log_extra)
+
+    async def _delivered(self, delivery):
+        """Подтверждает письмо в почтовом ящике, когда оно доставлено во все свои топики"""
+        msg_id = delivery.msg_id
+        if msg_id not in self.pending_deliveries:
+            return
+        self.pending_deliveries[msg_id] -= 1
+        if self.pending_deliveries[msg_id] <= 0:
+            del self.pending_deliveries[msg_id]
+            await self.acks.add(msg_id)
+
+    async def _send_part(self, thread_id, part):
+        """Отправляет текст или вложение; возвращает отправленное сообщение или None"""
+        if isinstance(part, dict):
+            # Данные вложения скачиваются только сейчас, непосредственно перед отправкой;
+            # сбой загрузки (например, временная ошибка Gmail) обрабатывается как сбой отправки
+            try:
+                attachment = self.mail.load_attachment(part)
+            except Exception as e:
+                logger.error(
+                    "Не удалось загрузить вложение %s: %s", part.get('filename'), e,
+                    extra={'msg_id': part.get('message_id'), 'thread_id': thread_id}
+                )
+                return None
+            return await self.telegram.send_attachment_to_thread(thread_id, attachment)
+        return await self.telegram.send_message_to_thread(thread_id, part)
 
+    def _validate_labels(self):
+        """Проверяет, существуют ли все указанные метки в почтовом ящике"""
+        missing_labels = self.router.missing_labels
         if missing_labels:
-            logger.error(f"Следующие метки не найдены в Gmail: {missing_labels}")
+            logger.error("Следующие метки не найдены в Gmail: %s", missing_labels)
             raise ValueError(f"Отсутствуют метки в Gmail: {missing_labels}")
 
-    def _get_thread_id_for_message(self, message: Dict[str, Any]) -> int:
-        """Определяет ID топика Telegram на основе меток сообщения"""
-        metadata = self.gmail.get_message_metadata(message['id'])
-        if not metadata:
-            logger.warning(f"Не удалось получить метаданные для сообщения {message['id']}")
-            return None
-
-        label_ids = metadata.get('labelIds', [])
-
-        for label_name, thread_id in Config.LABEL_TO_THREAD_MAPPING.items():
-            label_id = self.gmail.get_label_id(label_name)
-            if label_id and label_id in label_ids:
-                logger.debug(f"Найдено соответствие: метка '{label_name}' → топик {thread_id}")
-                return thread_id
-
-        logger.warning(
-            f"Не найдено соответствия для сообщения {message['id']}. "
-            f"Метки сообщения: {label_ids}. "
-            f"Доступные соответствия: {Config.LABEL_TO_THREAD_MAPPING}"
-        )
-        return None
-
-    async def _process_single_message(self, msg):
+    def _resolve_labels(self, mapping, rules):
+        """Дополняет кэш меток, запрашивая список у источника только при появлении новых названий"""
+        names = label_names(mapping, rules)
+        if any(name.lower() not in self.label_map for name in names):
+            self.label_map = self.mail.get_label_map()
+        return self.label_map
+
+    def apply_config(self, settings: Dict[str, Any]) -> bool:
+        """
+        Применяет перечитанные настройки на лету. Маршрутизатор собирается заново и
+        подменяется целиком, поэтому письма, уже стоящие в очереди, уходят по старым
+        правилам, а новые - по новым. Если какие-то метки не найдены, изменения
+        откатываются.
+        """
+        previous = Config.apply(settings)
+        try:
+            router = MessageRouter(
+                Config.LABEL_TO_THREAD_MAPPING, Config.ROUTING_RULES,
+                self._resolve_labels(Config.LABEL_TO_THREAD_MAPPING, Config.ROUTING_RULES)
+            )
+        except Exception as e:
+            Config.apply(previous)
+            logger.error("Не удалось применить новые правила маршрутизации: %s", e)
+            return False
+        if router.missing_labels:
+            Config.apply(previous)
+            logger.error("Новые настройки отклонены, метки не найдены: %s", router.missing_labels)
+            return False
+
+        self.router = router
+        self.labels = list(Config.LABEL_TO_THREAD_MAPPING.keys())
+        self.dedup.window = Config.DEDUP_WINDOW
+        self.dedup.text_window = Config.DEDUP_TEXT_WINDOW
+        logger.info("Применены новые настройки: %s", ', '.join(sorted(previous)))
+        return True
+
+    def _get_thread_ids_for_message(self, message: Dict[str, Any], parsed: Dict[str, Any]) -> List[int]:
+        """Определяет ID топиков Telegram на основе меток и содержимого сообщения"""
+        message_type = parsed['type'] if parsed else None
+        thread_ids = self.router.route(message, message_type)
+        if not thread_ids:
+            logger.warning(
+                "Не найдено соответствия для сообщения %s. Метки сообщения: %s. Доступные соответствия: %s",
+                message['id'], message.get('label_ids', []), Config.LABEL_TO_THREAD_MAPPING,
+                extra={'msg_id': message['id']}
+            )
+        return thread_ids
+
+    async def _process_single_message(self, msg, priority=PRIORITY_LIVE):
         """Асинхронно обрабатывает одно сообщение"""
         msg_id = msg['id']
+        # Живой опрос и выгрузка истории идут параллельно и могут встретить одно письмо
+        if msg_id in self.processed_messages or msg_id in self.in_progress:
+            logger.debug("Сообщение %s уже обработано, пропускаем", msg_id, extra={'msg_id': msg_id})
+            return
+        self.in_progress.add(msg_id)
         try:
-            if msg_id in self.processed_messages:
-                logger.debug(f"Сообщение {msg_id} уже обработано, пропускаем")
-                return
 
-            logger.debug(f"Обработка сообщения ID: {msg_id}")
+            # Выгрузка истории не должна съедать квоту живого опроса
+            await self.mail.throttle('messages.get', priority)
 
-            full_message = self.gmail.get_message_details(msg_id)
+            logger.debug("Обработка сообщения ID: %s", msg_id, extra={'msg_id': msg_id})
+
+            full_message = await self.mail.fetch_message(msg_id)
             if not full_message:
-                logger.error(f"Не удалось получить содержимое сообщения {msg_id}")
+                logger.error("Не удалось получить содержимое сообщения %s", msg_id, extra={'msg_id': msg_id})
                 return
 
-            thread_id = self._get_thread_id_for_message(msg)
-            if not thread_id:
-                logger.warning(f"Не найден топик для сообщения {msg_id}")
+            parsed = self.telegram.parse_message(full_message)
+            thread_ids = self._get_thread_ids_for_message(full_message, parsed)
+            if not thread_ids:
+                logger.warning("Не найден топик для сообщения %s", msg_id, extra={'msg_id': msg_id})
                 return
 
-            # Форматируем сообщение и добавляем в очередь
-            formatted_msg = self.telegram.format_message(full_message)
-            await self.message_queue.put((thread_id, formatted_msg))
-            logger.info(f"Сообщение {msg_id} добавлено в очередь для топика {thread_id}")
-
-            # Отправляем вложения (если есть) - тоже через очередь
-            for attachment in full_message.get('attachments', []):
-                await self.message_queue.put((thread_id, attachment))
-
-            # Помечаем как прочитанное в Gmail
-            if not self.gmail.mark_as_read(msg_id):
-                logger.error(f"Не удалось пометить сообщение {msg_id} как прочитанное")
+            # Повторное уведомление с тем же содержимым не отправляем
+            if self.dedup.is_duplicate(parsed, full_message):
+                logger.info(
+                    "Сообщение %s дублирует уже отправленное, пропускаем (всего подавлено дублей: %s)",
+                    msg_id, self.dedup.suppressed, extra={'msg_id': msg_id}
+                )
+                await self.acks.add(msg_id)
+                self.processed_messages.add(msg_id)
                 return
 
+            # Форматируем сообщение и добавляем в очередь
+            formatted_msg = self.telegram.format_message(full_message, parsed)
+            lane = LANE_LIVE if priority == PRIORITY_LIVE else LANE_BACKFILL
+            # Подтверждение в почтовом ящике - после доставки во все топики (см. _delivered)
+            self.pending_deliveries[msg_id] = len(thread_ids)
+            for thread_id in thread_ids:
+                # Вложения идут в той же полосе и том же элементе очереди, что и текст письма
+                delivery = Delivery(thread_id, formatted_msg, full_message.get('attachments', []), msg_id)
+                await self.message_queue.put(delivery, lane)
+                logger.info(
+                    "Сообщение %s добавлено в очередь для топика %s", msg_id, thread_id,
+                    extra={'msg_id': msg_id, 'thread_id': thread_id}
+                )
+
+            # Сохраняем платеж для сводок, чтобы итоги не требовали повторного разбора почты
+            if self.payments:
+                try:
+                    self.payments.record(msg_id, parsed, full_message, thread_ids)
+                except Exception as e:
+                    logger.error("Не удалось сохранить платеж %s: %s", msg_id, e, extra={'msg_id': msg_id})
+
             self.processed_messages.add(msg_id)
-            logger.info(f"Сообщение {msg_id} успешно обработано")
+            logger.info("Сообщение %s успешно обработано", msg_id, extra={'msg_id': msg_id})
 
         except Exception as e:
-            logger.error(f"Ошибка при обработке сообщения {msg_id}: {str(e)}")
+            logger.error("Ошибка при обработке сообщения %s: %s", msg_id, e, extra={'msg_id': msg_id})
             try:
-                self.gmail.mark_as_read(msg_id)
+                await self.acks.add(msg_id)
             except Exception as mark_error:
-                logger.error(f"Не удалось пометить сообщение {msg_id} как прочитанное: {str(mark_error)}")
+                logger.error(
+                    "Не удалось пометить сообщение %s как прочитанное: %s", msg_id, mark_error,
+                    extra={'msg_id': msg_id}
+                )
+        finally:
+            self.in_progress.discard(msg_id)
+
+    async def _process_stream(self, messages, priority, concurrency):
+        """
+        Обрабатывает сообщения не более чем concurrency за раз. Следующее письмо берется,
+        только когда предыдущее поставлено в очередь, поэтому при заполненной полосе
+        отправки в памяти остается не больше concurrency загруженных писем.
+        """
+        pending = iter(messages)
+
+        async def worker():
+            for msg in pending:
+                await self._process_single_message(msg, priority)
+
+        await asyncio.gather(*(worker() for _ in range(max(concurrency, 1))))
 
     async def process_all_messages(self):
         """Обрабатывает ВСЕ сообщения с указанными метками"""
@@ -144,83 +296,176 @@ class MailForwarderBot:
 
         # Получаем все сообщения (без ограничения по количеству)
         try:
-            label_ids = [self.gmail.get_label_id(name) for name in self.labels]
-            label_ids = [lid for lid in label_ids if lid is not None]
+            label_ids = self.router.label_ids
 
             if not label_ids:
                 logger.error("Не найдено ни одного из запрошенных ярлыков")
                 return
 
             # Получаем все сообщения с указанными метками
-            messages = []
-            page_token = None
-            while True:
-                results = self.gmail.service.users().messages().list(
-                    userId='me',
-                    labelIds=label_ids,
-                    maxResults=500,
-                    pageToken=page_token
-                ).execute()
-
-                messages.extend(results.get('messages', []))
-                page_token = results.get('nextPageToken')
-                if not page_token:
-                    break
+            messages = await self.mail.fetch_all(label_ids)
 
-            logger.info(f"Всего найдено {len(messages)} сообщений для обработки")
+            logger.info("Всего найдено %s сообщений для обработки", len(messages))
 
-            # Обрабатываем все сообщения
-            tasks = [self._process_single_message(msg) for msg in messages]
-            await asyncio.gather(*tasks)
+            await self._process_stream(messages, PRIORITY_BACKFILL, Config.BACKFILL_CONCURRENCY)
+            logger.info("Выгрузка истории завершена")
 
         except Exception as e:
-            logger.error(f"Ошибка при получении всех сообщений: {e}")
+            logger.error("Ошибка при получении всех сообщений: %s", e)
 
     async def process_new_messages(self):
         """Обрабатывает только новые сообщения"""
         logger.info("Проверка новых сообщений...")
-        messages = self.gmail.get_messages_with_labels(self.labels)
+        messages = await self.mail.fetch_unread(self.labels)
 
         if not messages:
             logger.debug("Новых сообщений не найдено")
             return
 
-        logger.info(f"Найдено {len(messages)} новых сообщений для обработки")
+        logger.info("Найдено %s новых сообщений для обработки", len(messages))
 
         tasks = [self._process_single_message(msg) for msg in messages]
         await asyncio.gather(*tasks)
 
+    async def replay(self):
+        """
+        Заново обрабатывает все письма офлайн-источника (архив ArchiveMailSource или кэш
+        CachedMailSource): письма проходят обычный путь разбора, маршрутизации и очереди
+        отправки, но без обращений к Gmail.
+        """
+        logger.info("Обработка писем из %s", self.mail.path)
+        await self.telegram.warm_up()
+        await self.start_message_sender()
+        try:
+            messages = await self.mail.fetch_all(self.router.label_ids)
+            # По одному письму: когда полоса выгрузки заполнена, чтение архива ждет отправки
+            await self._process_stream(messages, PRIORITY_BACKFILL, 1)
+            await self.message_queue.join()
+            logger.info("Обработка завершена, обработано сообщений: %s", len(self.processed_messages))
+        finally:
+            self.mail.close()
+
+    async def preview(self):
+        """Выводит результат разбора, маршрутизации и форматирования писем офлайн-источника без отправки"""
+        try:
+            for msg in await self.mail.fetch_all(self.router.label_ids):
+                details = await self.mail.fetch_message(msg['id'])
+                if not details:
+                    continue
+                parsed = self.telegram.parse_message(details)
+                thread_ids = self._get_thread_ids_for_message(details, parsed)
+                print(f"--- {msg['id']} ({parsed['type'] if parsed else 'нет тела'}) -> топики {thread_ids}")
+                print(self.telegram.format_message(details, parsed))
+        finally:
+            self.mail.close()
+
+    async def post_digests(self, day=None):
+        """
+        Ставит в очередь сводку за день (по умолчанию - сегодня) в каждый топик с платежами,
+        а если задан DIGEST_THREAD_ID - еще и общую сводку с разбивкой по счетам
+        """
+        day = day or datetime.now().date().isoformat()
+        for thread_id in self.payments.active_topics(day):
+            digest = format_digest(day, self.payments.topic_summary(day, thread_id))
+            await self.message_queue.put(Delivery(thread_id, digest), LANE_LIVE)
+            logger.info("Сводка за %s добавлена в очередь для топика %s", day, thread_id, extra={'thread_id': thread_id})
+
+        summary = self.payments.day_summary(day)
+        if Config.DIGEST_THREAD_ID is not None and summary['count']:
+            digest = format_digest(day, summary, self.payments.account_summaries(day))
+            await self.message_queue.put(Delivery(Config.DIGEST_THREAD_ID, digest), LANE_LIVE)
+            logger.info("Общая сводка за %s добавлена в очередь", day, extra={'thread_id': Config.DIGEST_THREAD_ID})
+
+    async def _digest_worker(self):
+        """Ежедневно в DIGEST_TIME отправляет сводки по топикам"""
+        last_day = None
+        while True:
+            await asyncio.sleep(seconds_until(Config.DIGEST_TIME))
+            # Сон идет по монотонным часам, а срок считается по системным: если часы
+            # отвели назад (NTP), seconds_until вернет почти ноль - не отправляем сводку дважды
+            day = datetime.now().date().isoformat()
+            if last_day is not None and day <= last_day:
+                await asyncio.sleep(60)
+                continue
+            last_day = day
+            try:
+                await self.post_digests(day)
+            except Exception as e:
+                logger.error("Ошибка при отправке сводок: %s", e)
+
     async def run(self):
         """Основной асинхронный цикл работы бота"""
         logger.info("Запуск Mail Forwarder Bot")
 
+        # Заранее открываем соединение с Telegram и держим его открытым
+        await self.telegram.warm_up()
+        self.keepalive_task = asyncio.create_task(self.telegram.keep_alive())
+
         # Запускаем фоновую задачу для отправки сообщений
         await self.start_message_sender()
+        self.ack_task = asyncio.create_task(self.acks.run())
+        self.config_task = asyncio.create_task(self.config_watcher.run())
+        if self.payments and Config.DIGEST_TIME:
+            self.digest_task = asyncio.create_task(self._digest_worker())
+        elif Config.DIGEST_TIME:
+            logger.warning("DIGEST_TIME задан, но PAYMENTS_DB пуст: сводки отправляться не будут")
 
-        # Сначала обрабатываем все существующие сообщения
-        await self.process_all_messages()
-
-        # Затем переходим к периодической проверке новых сообщений
         try:
+            # Выгрузка истории идет в фоне и не задерживает проверку новых сообщений
+            self.backfill_task = asyncio.create_task(self.process_all_messages())
+
             while True:
                 start_time = time.time()
                 await self.process_new_messages()
 
                 elapsed = time.time() - start_time
                 sleep_time = max(0, Config.CHECK_INTERVAL - elapsed)
-                await asyncio.sleep(sleep_time)
+                # IMAP-источник вернется раньше, если сервер сообщит о новой почте
+                await self.mail.wait_for_mail(sleep_time)
 
         except KeyboardInterrupt:
             logger.info("Бот остановлен пользователем")
         except Exception as e:
-            logger.error(f"Критическая ошибка в боте: {e}")
+            logger.error("Критическая ошибка в боте: %s", e)
             raise
+        finally:
+            # Подтверждаем все накопленные сообщения перед остановкой
+            await self.acks.flush()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Пересылка банковских писем из почты в топики Telegram')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('run', help='пересылать новую почту (по умолчанию)')
+    import_parser = commands.add_parser('import', help='импортировать историю из mbox или каталога с .eml')
+    import_parser.add_argument('path', help='файл mbox (например, из Google Takeout) или каталог с .eml')
+    import_parser.add_argument(
+        '--label', action='append', default=[],
+        help='метка для писем без заголовка X-Gmail-Labels (можно указать несколько раз)'
+    )
+    reprocess_parser = commands.add_parser(
+        'reprocess', help='заново разобрать письма из кэша MESSAGE_CACHE_DIR без обращений к Gmail'
+    )
+    reprocess_parser.add_argument(
+        '--send', action='store_true', help='отправить результат в топики (по умолчанию - только вывести)'
+    )
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    bot = MailForwarderBot()
+    args = parse_args()
     try:
-        asyncio.run(bot.run())
+        if args.command == 'import':
+            bot = MailForwarderBot(ArchiveMailSource(args.path, args.label))
+            asyncio.run(bot.replay())
+        elif args.command == 'reprocess':
+            if not Config.MESSAGE_CACHE_DIR:
+                raise ValueError("Для повторной обработки нужен кэш писем: задайте MESSAGE_CACHE_DIR")
+            bot = MailForwarderBot(CachedMailSource())
+            asyncio.run(bot.replay() if args.send else bot.preview())
+        else:
+            bot = MailForwarderBot()
+            asyncio.run(bot.run())
     except Exception as e:
-        logger.critical(f"Не удалось запустить бота: {e}")
+        logger.critical("Не удалось запустить бота: %s", e)
         raise
\ No newline at end of file
@@ -1,11 +1,84 @@
 import os
+import re
 import json
-from dotenv import load_dotenv
+import atexit
+import copy
+import queue
+from dotenv import load_dotenv, dotenv_values
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
 
+# Окружение процесса до подмешивания .env: при перезагрузке настроек значения, взятые
+# при запуске из .env, читаются заново из файла, а не из os.environ
+_PROCESS_ENV = dict(os.environ)
 load_dotenv()
 
 
+def _parse_bool(value):
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def _parse_time_of_day(value):
+    """Проверяет время вида 'ЧЧ:ММ' (пустая строка допустима); при ошибке выбрасывает ValueError"""
+    value = value.strip()
+    if value and not re.fullmatch(r'([01]?\d|2[0-3]):[0-5]\d', value):
+        raise ValueError(f"Неверное время '{value}': ожидается ЧЧ:ММ")
+    return value
+
+
+# Настройки, которые можно менять без перезапуска: название -> (значение по умолчанию, разбор)
+_RELOADABLE_SETTINGS = {
+    'LABEL_TO_THREAD_MAPPING': (None, json.loads),
+    'ROUTING_RULES': ('[]', json.loads),
+    'CHECK_INTERVAL': ('300', int),
+    'MAX_MESSAGE_LENGTH': ('4000', int),
+    'DEDUP_WINDOW': ('600', int),
+    'DEDUP_TEXT_WINDOW': ('60', int),
+    'GMAIL_DIAGNOSTICS': ('true', _parse_bool),
+}
+
+
+def _read_setting(name, env=os.environ):
+    default, parse = _RELOADABLE_SETTINGS[name]
+    return parse(env.get(name, default))
+
+
+def _check_thread_ids(threads, where):
+    """ID топиков проверяются так же, как их разбирает MessageRouter: через int()"""
+    for thread_id in threads if isinstance(threads, list) else [threads]:
+        try:
+            int(thread_id)
+        except (TypeError, ValueError):
+            raise ValueError(f"Неверный ID топика {where}: {thread_id!r}")
+
+
+def _validate_settings(settings):
+    """Проверяет перезагружаемые настройки; при ошибке выбрасывает ValueError"""
+    mapping = settings['LABEL_TO_THREAD_MAPPING']
+    if not isinstance(mapping, dict) or not mapping:
+        raise ValueError("LABEL_TO_THREAD_MAPPING должен быть непустым объектом")
+    for label, threads in mapping.items():
+        _check_thread_ids(threads, f"для метки '{label}'")
+
+    if not isinstance(settings['ROUTING_RULES'], list):
+        raise ValueError("ROUTING_RULES должен быть списком")
+    for rule in settings['ROUTING_RULES']:
+        if not isinstance(rule, dict) or 'threads' not in rule:
+            raise ValueError(f"Правило маршрутизации без 'threads': {rule!r}")
+        _check_thread_ids(rule['threads'], f"в правиле {rule!r}")
+        for key in ('from', 'subject'):
+            if rule.get(key):
+                try:
+                    re.compile(rule[key])
+                except re.error as e:
+                    raise ValueError(f"Неверное регулярное выражение '{rule[key]}': {e}")
+
+    if settings['CHECK_INTERVAL'] <= 0:
+        raise ValueError("CHECK_INTERVAL должен быть положительным")
+    if not 0 < settings['MAX_MESSAGE_LENGTH'] <= 4096:
+        raise ValueError("MAX_MESSAGE_LENGTH должен быть от 1 до 4096 (ограничение Telegram)")
+
+
 class Config:
     # Gmail configuration
     GMAIL_CLIENT_ID = os.getenv('GMAIL_CLIENT_ID')
@@ -15,22 +88,190 @@ class Config:
     # Telegram configuration
     TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
     TELEGRAM_GROUP_ID = int(os.getenv('TELEGRAM_GROUP_ID'))
+    TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org/bot')
+    TELEGRAM_HTTP2 = os.getenv('TELEGRAM_HTTP2', 'true').lower() in ('1', 'true', 'yes')
+    TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', '20'))
+    TELEGRAM_CONNECT_TIMEOUT = float(os.getenv('TELEGRAM_CONNECT_TIMEOUT', '5'))
+    TELEGRAM_READ_TIMEOUT = float(os.getenv('TELEGRAM_READ_TIMEOUT', '10'))
+    TELEGRAM_WRITE_TIMEOUT = float(os.getenv('TELEGRAM_WRITE_TIMEOUT', '10'))
+    TELEGRAM_POOL_TIMEOUT = float(os.getenv('TELEGRAM_POOL_TIMEOUT', '5'))
+    TELEGRAM_MEDIA_TIMEOUT = float(os.getenv('TELEGRAM_MEDIA_TIMEOUT', '60'))  # загрузка вложений
+    TELEGRAM_KEEPALIVE_EXPIRY = float(os.getenv('TELEGRAM_KEEPALIVE_EXPIRY', '120'))
+    TELEGRAM_KEEPALIVE_INTERVAL = float(os.getenv('TELEGRAM_KEEPALIVE_INTERVAL', '60'))
 
     # Label to thread mapping
-    LABEL_TO_THREAD_MAPPING = json.loads(os.getenv('LABEL_TO_THREAD_MAPPING'))
+    LABEL_TO_THREAD_MAPPING = _read_setting('LABEL_TO_THREAD_MAPPING')
+
+    # Additional routing rules: [{"from": "...", "subject": "...", "type": "sbp", "labels": [...], "threads": [...]}]
+    ROUTING_RULES = _read_setting('ROUTING_RULES')
 
     # Other settings
-    CHECK_INTERVAL = int(os.getenv('CHECK_INTERVAL', '300'))  # 5 minutes by default
-    MAX_MESSAGE_LENGTH = int(os.getenv('MAX_MESSAGE_LENGTH', '4000'))
+    CHECK_INTERVAL = _read_setting('CHECK_INTERVAL')  # 5 minutes by default
+    MAX_MESSAGE_LENGTH = _read_setting('MAX_MESSAGE_LENGTH')
+
+    # Hot reload: файл с настройками и период проверки его изменений (0 - только по SIGHUP)
+    ENV_FILE = os.getenv('ENV_FILE', '.env')
+    CONFIG_WATCH_INTERVAL = float(os.getenv('CONFIG_WATCH_INTERVAL', '10'))
+
+    # Logging
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    LOG_FILE = os.getenv('LOG_FILE', 'logs/mail_bot.log')
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+    LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', '')  # например 'midnight'; пусто - ротация по размеру
+    LOG_JSON = os.getenv('LOG_JSON', 'false').lower() in ('1', 'true', 'yes')
+
+    # Content deduplication
+    DEDUP_WINDOW = _read_setting('DEDUP_WINDOW')  # секунд; 0 - отключить
+    # Окно для писем без номера платежа и остатка (СБП, нераспознанные): они сравниваются по тексту
+    DEDUP_TEXT_WINDOW = _read_setting('DEDUP_TEXT_WINDOW')
+    DEDUP_MAX_SIZE = int(os.getenv('DEDUP_MAX_SIZE', '10000'))
+
+    # Mail backend: 'gmail' (REST API) or 'imap' (IMAP IDLE)
+    MAIL_BACKEND = os.getenv('MAIL_BACKEND', 'gmail').lower()
+    IMAP_HOST = os.getenv('IMAP_HOST', 'imap.gmail.com')
+    IMAP_PORT = int(os.getenv('IMAP_PORT', '993'))
+    IMAP_SSL = os.getenv('IMAP_SSL', 'true').lower() in ('1', 'true', 'yes')
+    IMAP_USER = os.getenv('IMAP_USER')
+    IMAP_PASSWORD = os.getenv('IMAP_PASSWORD')
+    IMAP_IDLE_MAILBOX = os.getenv('IMAP_IDLE_MAILBOX', 'INBOX')
+    IMAP_TIMEOUT = float(os.getenv('IMAP_TIMEOUT', '30'))
+
+    # Send lanes: веса для взвешенного перебора и предельная глубина (0 - без ограничения)
+    SEND_LANE_WEIGHTS = json.loads(os.getenv(
+        'SEND_LANE_WEIGHTS', '{"live": 8, "retry": 2, "backfill": 1}'
+    ))
+    SEND_LANE_LIMITS = json.loads(os.getenv('SEND_LANE_LIMITS', '{"backfill": 1000}'))
+    # Сколько раз повторять неудавшуюся отправку, прежде чем отказаться от нее
+    SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', '5'))
+    # Сколько писем истории загружается и разбирается одновременно
+    BACKFILL_CONCURRENCY = int(os.getenv('BACKFILL_CONCURRENCY', '4'))
+
+    # Batched acknowledgements
+    ACK_BATCH_SIZE = int(os.getenv('ACK_BATCH_SIZE', '1000'))
+    ACK_FLUSH_INTERVAL = float(os.getenv('ACK_FLUSH_INTERVAL', '10'))
+    # Через запятую: read (снять UNREAD), archive (снять INBOX), label:<название> (добавить метку)
+    GMAIL_ACK_ACTIONS = [a.strip() for a in os.getenv('GMAIL_ACK_ACTIONS', 'read').split(',') if a.strip()]
+
+    # Gmail API quota
+    GMAIL_QUOTA_LIMIT = int(os.getenv('GMAIL_QUOTA_LIMIT', '250'))  # единиц квоты на окно
+    GMAIL_QUOTA_WINDOW = float(os.getenv('GMAIL_QUOTA_WINDOW', '1'))  # длина окна в секундах
+    GMAIL_QUOTA_BACKFILL_SHARE = float(os.getenv('GMAIL_QUOTA_BACKFILL_SHARE', '0.6'))
+    GMAIL_QUOTA_OPTIONAL_SHARE = float(os.getenv('GMAIL_QUOTA_OPTIONAL_SHARE', '0.3'))
+    # 'full' - только заголовки и текст, вложения скачиваются по требованию; 'raw' - письмо целиком
+    GMAIL_FETCH_MODE = os.getenv('GMAIL_FETCH_MODE', 'full').lower()
+    GMAIL_DIAGNOSTICS = _read_setting('GMAIL_DIAGNOSTICS')
+
+    # Payment store: SQLite-файл с разобранными платежами и сводками (пусто - не сохранять)
+    PAYMENTS_DB = os.getenv('PAYMENTS_DB', '')
+    # Ежедневная сводка по топикам в указанное время, например '21:00' (пусто - не отправлять)
+    DIGEST_TIME = _parse_time_of_day(os.getenv('DIGEST_TIME', ''))
+    # Топик для общей сводки за день с разбивкой по счетам (пусто - не отправлять)
+    DIGEST_THREAD_ID = int(os.getenv('DIGEST_THREAD_ID')) if os.getenv('DIGEST_THREAD_ID') else None
+
+    # Кэш file_id Telegram для повторяющихся вложений: JSON-файл (пусто - не кэшировать) и число записей
+    FILE_ID_CACHE = os.getenv('FILE_ID_CACHE', '')
+    FILE_ID_CACHE_SIZE = int(os.getenv('FILE_ID_CACHE_SIZE', '1000'))
+
+    # Кэш исходных писем для повторной обработки без Gmail API (пусто - не кэшировать)
+    MESSAGE_CACHE_DIR = os.getenv('MESSAGE_CACHE_DIR', '')
+    MESSAGE_CACHE_MAX_BYTES = int(os.getenv('MESSAGE_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+
+    @classmethod
+    def read_reloadable(cls):
+        """
+        Заново читает перезагружаемые настройки из окружения процесса и ENV_FILE (значения
+        из файла имеют приоритет) и проверяет их. Настройка, удаленная из файла,
+        возвращается к значению по умолчанию. Текущие настройки не меняются.
+        """
+        env = {**_PROCESS_ENV, **dotenv_values(cls.ENV_FILE)}
+        settings = {name: _read_setting(name, env) for name in _RELOADABLE_SETTINGS}
+        _validate_settings(settings)
+        return settings
+
+    @classmethod
+    def apply(cls, settings):
+        """Применяет настройки и возвращает прежние значения изменившихся"""
+        previous = {name: getattr(cls, name) for name, value in settings.items() if getattr(cls, name) != value}
+        for name in previous:
+            setattr(cls, name, settings[name])
+        return previous
+
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_log_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует записи лога в JSON; ID сообщения и топика выносятся в отдельные поля"""
+
+    FIELDS = ('msg_id', 'thread_id')
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'logger': record.name,
+            'level': record.levelname,
+            'message': record.getMessage(),
+        }
+        for field in self.FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _LogQueueHandler(QueueHandler):
+    """
+    Подставляет аргументы в сообщение до постановки в очередь, но трейсбек
+    оставляет отдельно в exc_text, а не склеивает с текстом сообщения: так его
+    видят и текстовый, и JSON-форматтер в потоке слушателя.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
 
 
 def setup_logging():
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler('logs/mail_bot.log'),
-            logging.StreamHandler()
-        ]
-    )
+    """
+    Настраивает логирование: записи складываются в очередь, а в файл (с ротацией)
+    и в консоль их пишет отдельный поток QueueListener, не блокируя цикл событий.
+    """
+    global _log_listener
+    if _log_listener is None:
+        if Config.LOG_ROTATE_WHEN:
+            file_handler = TimedRotatingFileHandler(
+                Config.LOG_FILE, when=Config.LOG_ROTATE_WHEN,
+                backupCount=Config.LOG_BACKUP_COUNT, encoding='utf-8'
+            )
+        else:
+            file_handler = RotatingFileHandler(
+                Config.LOG_FILE, maxBytes=Config.LOG_MAX_BYTES,
+                backupCount=Config.LOG_BACKUP_COUNT, encoding='utf-8'
+            )
+        stream_handler = logging.StreamHandler()
+        formatter = JsonFormatter() if Config.LOG_JSON else logging.Formatter(LOG_FORMAT)
+        for handler in (file_handler, stream_handler):
+            handler.setFormatter(formatter)
+
+        log_queue = queue.SimpleQueue()
+        _log_listener = QueueListener(log_queue, file_handler, stream_handler)
+        _log_listener.start()
+        atexit.register(_log_listener.stop)
+
+        # Сообщение подставляется в запись заранее, итоговое форматирование - в потоке слушателя
+        queue_handler = _LogQueueHandler(log_queue)
+        logging.basicConfig(level=Config.LOG_LEVEL, handlers=[queue_handler])
     return logging.getLogger(__name__)
\ No newline at end of file
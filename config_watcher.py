@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import os
+import signal
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigWatcher:
+    """
+    Следит за изменениями перезагружаемых настроек (маршрутизация, интервалы,
+    окно дедупликации) без перезапуска бота. Перечитывание запускается по сигналу
+    SIGHUP или при изменении времени модификации ENV_FILE (проверка раз в
+    CONFIG_WATCH_INTERVAL секунд). Новые настройки сначала проверяются целиком:
+    при ошибке бот продолжает работать со старыми.
+    """
+
+    def __init__(self, on_change, env_file=None, interval=None):
+        self.on_change = on_change
+        self.env_file = env_file or Config.ENV_FILE
+        self.interval = Config.CONFIG_WATCH_INTERVAL if interval is None else interval
+        self.reload_requested = asyncio.Event()
+        self._mtime = self._get_mtime()
+
+    def _get_mtime(self):
+        try:
+            return os.stat(self.env_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def _install_signal_handler(self):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, self.reload_requested.set)
+        except (AttributeError, NotImplementedError, RuntimeError):
+            # Нет SIGHUP (Windows) или цикл событий запущен не в главном потоке
+            logger.info("SIGHUP недоступен, настройки перечитываются только при изменении %s", self.env_file)
+
+    def reload(self):
+        """Перечитывает настройки и применяет изменившиеся; возвращает True при успехе"""
+        try:
+            settings = Config.read_reloadable()
+        except (ValueError, TypeError, OSError) as e:
+            logger.error("Новые настройки отклонены, продолжаем со старыми: %s", e)
+            return False
+
+        changed = {name: value for name, value in settings.items() if getattr(Config, name) != value}
+        if not changed:
+            logger.info("Настройки не изменились")
+            return True
+        return self.on_change(changed)
+
+    async def run(self):
+        self._install_signal_handler()
+        while True:
+            try:
+                if self.interval > 0:
+                    await asyncio.wait_for(self.reload_requested.wait(), self.interval)
+                else:
+                    await self.reload_requested.wait()
+                logger.info("Получен SIGHUP, перечитываем настройки")
+            except asyncio.TimeoutError:
+                mtime = self._get_mtime()
+                if mtime == self._mtime:
+                    continue
+                logger.info("Файл %s изменился, перечитываем настройки", self.env_file)
+            self.reload_requested.clear()
+            self._mtime = self._get_mtime()
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error("Ошибка при перезагрузке настроек: %s", e)
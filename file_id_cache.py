@@ -0,0 +1,81 @@
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def content_digest(attachment):
+    """SHA-256 содержимого вложения (attachment['data'])"""
+    return hashlib.sha256(attachment['data']).hexdigest()
+
+
+class FileIdCache:
+    """
+    Кэш file_id, которые Telegram вернул при первой загрузке файла, по хэшу
+    содержимого. Повторно присланное вложение (тарифы, шаблоны выписок, логотипы)
+    отправляется по file_id без загрузки байтов. Размер ограничен max_size
+    записями, при переполнении вытесняются давно не использованные. Кэш хранится
+    в JSON-файле и переживает перезапуск.
+    """
+
+    def __init__(self, path=None, max_size=None):
+        self.path = path or Config.FILE_ID_CACHE
+        self.max_size = max_size or Config.FILE_ID_CACHE_SIZE
+        self._entries = OrderedDict()  # '<вид>:<sha256>' -> file_id, от давних к свежим
+        self.hits = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                self._entries.update(json.load(file))
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning("Не удалось прочитать кэш file_id %s: %s", self.path, e)
+            return
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        logger.info("Загружен кэш file_id: %s записей", len(self._entries))
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Пишем во временный файл и подменяем, чтобы сбой не оставил обрезанный JSON
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(self._entries, file)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("Не удалось сохранить кэш file_id %s: %s", self.path, e)
+
+    def get(self, kind, digest):
+        key = f"{kind}:{digest}"
+        file_id = self._entries.get(key)
+        if file_id is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return file_id
+
+    def put(self, kind, digest, file_id):
+        key = f"{kind}:{digest}"
+        if self._entries.get(key) == file_id:
+            return
+        self._entries[key] = file_id
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        self._save()
+
+    def evict(self, kind, digest):
+        if self._entries.pop(f"{kind}:{digest}", None) is not None:
+            self._save()
+
+    def __len__(self):
+        return len(self._entries)
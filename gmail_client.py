@@ -1,32 +1,62 @@
+import asyncio
 import base64
 import email
+import email.header
+import email.message
 import logging
 from typing import List, Dict
 from config import Config
+from gmail_quota import GmailQuota, PRIORITY_BACKFILL, PRIORITY_OPTIONAL
+from mail_source import MailSource
 from googleapiclient.discovery import build
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 
 logger = logging.getLogger(__name__)
 
+# Маски частичного ответа (fields): Gmail возвращает только поля, которые бот читает
+_LIST_FIELDS = 'messages(id),nextPageToken'
+_LABELS_FIELDS = 'labels(id,name)'
+_LABEL_STATS_FIELDS = 'messagesTotal,messagesUnread'
+_METADATA_FIELDS = 'id,labelIds,payload/headers'
+_FULL_FIELDS = 'id,labelIds,payload'
+_RAW_FIELDS = 'id,labelIds,raw'
+_LABEL_IDS_FIELDS = 'labelIds'
 
-def _extract_body(msg):
-    if msg.is_multipart():
-        for part in msg.walk():
-            content_type = part.get_content_type()
-            if content_type == 'text/plain':
-                payload = part.get_payload(decode=True)
-                charset = part.get_content_charset() or 'utf-8'
-                return payload.decode(charset, errors='replace')
-    else:
-        payload = msg.get_payload(decode=True)
-        charset = msg.get_content_charset() or 'utf-8'
-        return payload.decode(charset, errors='replace')
-    return ''
+# Рекомендуемый Google предел вызовов в одном пакетном HTTP-запросе
+_BATCH_LIMIT = 50
+# Повторы страницы списка по метке, запрос которой не удался: число попыток и предел паузы в секундах
+_LIST_RETRIES = 5
+_LIST_MAX_BACKOFF = 60
 
 
-def _get_header(msg, header_name):
-    header = msg.get(header_name, '')
+def _is_attachment(part):
+    """Вложение - любая часть с именем файла (так же определяет вложения Gmail в format='full')"""
+    return part.get_content_maintype() != 'multipart' and bool(part.get_filename())
+
+
+def _extract_body(msg):
+    """
+    Текст письма так же, как в разборе format='full': text/plain, а если его нет -
+    text/html; части-вложения текстом не считаются
+    """
+    text_parts = {}
+    for part in msg.walk():
+        content_type = part.get_content_type()
+        if content_type in ('text/plain', 'text/html') and not _is_attachment(part):
+            text_parts.setdefault(content_type, part)
+
+    text_part = text_parts.get('text/plain') or text_parts.get('text/html')
+    if text_part is None and not msg.is_multipart() and not _is_attachment(msg):
+        text_part = msg
+    if text_part is None:
+        return ''
+    payload = text_part.get_payload(decode=True) or b''
+    charset = text_part.get_content_charset() or 'utf-8'
+    return payload.decode(charset, errors='replace')
+
+
+def _decode_header_value(header):
     if header:
         decoded = email.header.decode_header(header)
         return ''.join(
@@ -36,7 +66,49 @@ def _get_header(msg, header_name):
     return ''
 
 
-class GmailClient:
+def _get_header(msg, header_name):
+    return _decode_header_value(msg.get(header_name, ''))
+
+
+def _walk_parts(part):
+    """Обходит дерево частей из ответа format='full' в том же порядке, что и Message.walk()"""
+    yield part
+    for child in part.get('parts', []):
+        yield from _walk_parts(child)
+
+
+def _get_part_header(part, header_name):
+    for header in part.get('headers', []):
+        if header['name'].lower() == header_name.lower():
+            return header['value']
+    return ''
+
+
+def _get_part_charset(part):
+    content_type = email.message.Message()
+    content_type['Content-Type'] = _get_part_header(part, 'Content-Type') or 'text/plain'
+    return content_type.get_content_charset() or 'utf-8'
+
+
+def _decode_part_data(data):
+    return base64.urlsafe_b64decode(data.encode('ASCII') + b'=' * (-len(data) % 4))
+
+
+def parse_raw_message(raw, msg_id, label_ids=()):
+    """Разбирает письмо в формате RFC 822 в словарь деталей сообщения"""
+    mime_msg = email.message_from_bytes(raw)
+    return {
+        'subject': _get_header(mime_msg, 'Subject'),
+        'from': _get_header(mime_msg, 'From'),
+        'date': _get_header(mime_msg, 'Date'),
+        'body': _extract_body(mime_msg),
+        'attachments': GmailClient._extract_attachments(mime_msg),
+        'label_ids': list(label_ids),
+        'id': msg_id
+    }
+
+
+class GmailClient(MailSource):
     def __init__(self):
         self.creds = Credentials(
             token=None,
@@ -46,6 +118,18 @@ class GmailClient:
             client_secret=Config.GMAIL_CLIENT_SECRET
         )
         self.service = build('gmail', 'v1', credentials=self.creds)
+        self.quota = GmailQuota()
+        self._ack_body = None
+        if Config.MESSAGE_CACHE_DIR:
+            from message_cache import RawMessageCache
+            self.cache = RawMessageCache()
+        else:
+            self.cache = None
+
+    def _execute(self, request, method, count=1):
+        """Выполняет запрос к Gmail API с учетом израсходованной квоты"""
+        self.quota.charge(method, count)
+        return request.execute()
 
     def _refresh_token(self):
         try:
@@ -53,34 +137,71 @@ class GmailClient:
             logger.info("Gmail token refreshed successfully")
             return True
         except Exception as e:
-            logger.error(f"Error refreshing Gmail token: {e}")
+            logger.error("Error refreshing Gmail token: %s", e)
             return False
 
-    def get_label_id(self, label_name):
-        try:
-            results = self.service.users().labels().list(userId='me').execute()
-            labels = results.get('labels', [])
-            for label in labels:
-                if label['name'].lower() == label_name.lower():
-                    return label['id']
-            return None
-        except Exception as e:
-            logger.error(f"Error getting label ID: {e}")
-            return None
-
-    def get_message_metadata(self, msg_id: str) -> Dict:
-        """Получает метаданные сообщения (включая labels)"""
+    def get_label_map(self) -> Dict[str, str]:
+        """Возвращает соответствие названий меток (в нижнем регистре) и их ID"""
         try:
-            return self.service.users().messages().get(
-                userId='me',
-                id=msg_id,
-                format='metadata',
-                metadataHeaders=['labels']
-            ).execute()
+            results = self._execute(
+                self.service.users().labels().list(userId='me', fields=_LABELS_FIELDS), 'labels.list'
+            )
+            label_map = {label['name'].lower(): label['id'] for label in results.get('labels', [])}
+            if self.cache is not None:
+                self.cache.save_label_map(label_map)
+            return label_map
         except Exception as e:
-            logger.error(f"Error getting message metadata: {e}")
+            logger.error("Error getting labels: %s", e)
             return {}
 
+    def get_label_id(self, label_name):
+        return self.get_label_map().get(label_name.lower())
+
+    def _list_request(self, label_ids, query=None, page_token=None, max_results=500):
+        return self.service.users().messages().list(
+            userId='me',
+            labelIds=label_ids,
+            q=query,
+            maxResults=max_results,
+            pageToken=page_token,
+            fields=_LIST_FIELDS
+        )
+
+    def list_messages_by_label(self, page_tokens, query=None, max_results=500):
+        """
+        Один шаг постраничной выборки сразу по нескольким меткам.
+
+        page_tokens - {ID метки: токен следующей страницы или None для первой}.
+        Запросы по всем меткам уходят пакетами (batch) - по одному HTTP-запросу на
+        _BATCH_LIMIT меток, результаты объединяются без повторов по ID сообщения.
+        Возвращает ({ID сообщения: сообщение}, {ID метки: токен следующей страницы},
+        {ID метки: ошибка}). Токены возвращаются только для меток, у которых еще остались
+        страницы; для метки с ошибкой - прежний токен, чтобы повторить ту же страницу.
+        """
+        messages = {}
+        next_tokens = {}
+        failed = {}
+
+        def callback(label_id, response, exception):
+            if exception is not None:
+                logger.error("Ошибка получения списка сообщений по метке %s: %s", label_id, exception)
+                failed[label_id] = exception
+                next_tokens[label_id] = page_tokens[label_id]
+                return
+            for message in response.get('messages', []):
+                messages.setdefault(message['id'], message)
+            if response.get('nextPageToken'):
+                next_tokens[label_id] = response['nextPageToken']
+
+        streams = list(page_tokens.items())
+        for start in range(0, len(streams), _BATCH_LIMIT):
+            chunk = streams[start:start + _BATCH_LIMIT]
+            batch = self.service.new_batch_http_request(callback=callback)
+            for label_id, page_token in chunk:
+                batch.add(self._list_request([label_id], query, page_token, max_results), request_id=label_id)
+            self._execute(batch, 'messages.list', len(chunk))
+        return messages, next_tokens, failed
+
     def get_messages_with_labels(self, label_names: List[str]) -> List[Dict]:
         """
         Получает непрочитанные сообщения с указанными метками
@@ -98,161 +219,308 @@ class GmailClient:
 
         # 2. Получение ID меток с проверкой
         label_info = []
+        label_map = self.get_label_map()
         for name in label_names:
 
-            label_id = self.get_label_id(name)
+            label_id = label_map.get(name.lower())
             if not label_id:
-                logger.warning(f"Метка '{name}' не найдена в аккаунте")
+                logger.warning("Метка '%s' не найдена в аккаунте", name)
                 continue
 
-            # Получаем статистику по метке
+            info = {'name': name, 'id': label_id, 'total': None, 'unread': None}
+            label_info.append(info)
+
+            # Статистика по метке необязательна: запрашиваем ее только при включенной
+            # диагностике и свободном бюджете квоты
+            if not Config.GMAIL_DIAGNOSTICS or not self.quota.try_spend('labels.get', PRIORITY_OPTIONAL):
+                continue
             try:
                 stats = self.service.users().labels().get(
                     userId='me',
-                    id=label_id
+                    id=label_id,
+                    fields=_LABEL_STATS_FIELDS
                 ).execute()
-                label_info.append({
-                    'name': name,
-                    'id': label_id,
-                    'total': stats.get('messagesTotal', 0),
-                    'unread': stats.get('messagesUnread', 0)
-                })
+                info['total'] = stats.get('messagesTotal', 0)
+                info['unread'] = stats.get('messagesUnread', 0)
             except Exception as e:
-                logger.error(f"Ошибка получения статистики для метки '{name}': {e}")
-                continue
+                logger.error("Ошибка получения статистики для метки '%s': %s", name, e)
 
         # 3. Проверка наличия непрочитанных сообщений
         if not label_info:
             logger.error("Не найдено ни одной доступной метки")
             return []
 
-        logger.info("Статистика по меткам:")
+        if Config.GMAIL_DIAGNOSTICS:
+            logger.info("Статистика по меткам:")
         for info in label_info:
+            if info['unread'] is None:
+                continue
             logger.info(
-                f"Метка: {info['name']} (ID: {info['id']})\n"
-                f"• Всего сообщений: {info['total']}\n"
-                f"• Непрочитанных: {info['unread']}"
+                "Метка: %s (ID: %s)\n• Всего сообщений: %s\n• Непрочитанных: %s",
+                info['name'], info['id'], info['total'], info['unread']
             )
 
-        # 4. Получение непрочитанных сообщений
+        # 4. Получение непрочитанных сообщений: по каждой метке отдельно (labelIds в одном
+        # запросе Gmail объединяет по И), метки с известным нулем непрочитанных пропускаем
         try:
-            # Вариант 1: Стандартный запрос
-            results = self.service.users().messages().list(
-                userId='me',
-                labelIds=[info['id'] for info in label_info],
-                q="is:unread",
-                maxResults=50  # Лимит для теста
-            ).execute()
-
-            messages = results.get('messages', [])
-
-            # Если сообщений не найдено, пробуем альтернативный метод
-            if not messages:
-                logger.info("Пробуем альтернативный метод поиска...")
-                for info in label_info:
-                    if info['unread'] > 0:
-                        # Вариант 2: Поиск по каждой метке отдельно
-                        results = self.service.users().messages().list(
-                            userId='me',
-                            labelIds=[info['id']],
-                            q="is:unread"
-                        ).execute()
-                        messages.extend(results.get('messages', []))
+            page_tokens = {info['id']: None for info in label_info if info['unread'] != 0}
+            # Метки с ошибкой будут запрошены снова при следующей проверке
+            found, _, _ = self.list_messages_by_label(page_tokens, query="is:unread", max_results=100)
+            messages = list(found.values())
 
             # 5. Диагностика найденных сообщений
             if messages:
-                logger.info(f"Найдено непрочитанных сообщений: {len(messages)}")
-
-                # Логируем информацию о первых 3 сообщениях
-                for msg in messages[:3]:
+                logger.info("Найдено непрочитанных сообщений: %s", len(messages))
+
+                # Логируем информацию о первых 3 сообщениях (только для диагностики
+                # и только если DEBUG-записи вообще попадут в лог)
+                diagnostics = Config.GMAIL_DIAGNOSTICS and logger.isEnabledFor(logging.DEBUG)
+                for msg in messages[:3] if diagnostics else []:
+                    if not self.quota.try_spend('messages.get', PRIORITY_OPTIONAL):
+                        break
                     try:
                         msg_data = self.service.users().messages().get(
                             userId='me',
                             id=msg['id'],
                             format='metadata',
-                            metadataHeaders=['subject', 'from', 'date']
+                            metadataHeaders=['subject', 'from', 'date'],
+                            fields=_METADATA_FIELDS
                         ).execute()
                         logger.debug(
-                            "Пример сообщения:\n"
-                            f"ID: {msg['id']}\n"
-                            f"Тема: {msg_data.get('subject', 'Нет темы')}\n"
-                            f"От: {msg_data.get('from', 'Нет отправителя')}\n"
-                            f"Дата: {msg_data.get('date', 'Нет даты')}"
+                            "Пример сообщения:\nID: %s\nТема: %s\nОт: %s\nДата: %s",
+                            msg['id'],
+                            msg_data.get('subject', 'Нет темы'),
+                            msg_data.get('from', 'Нет отправителя'),
+                            msg_data.get('date', 'Нет даты'),
+                            extra={'msg_id': msg['id']}
                         )
                     except Exception as e:
-                        logger.error(f"Ошибка получения данных сообщения: {e}")
+                        logger.error("Ошибка получения данных сообщения: %s", e)
             else:
                 logger.info("Непрочитанных сообщений не найдено")
 
             return messages
 
         except Exception as e:
-            logger.error(f"Ошибка при поиске сообщений: {e}", exc_info=True)
+            logger.error("Ошибка при поиске сообщений: %s", e, exc_info=True)
             return []
 
     def get_message_details(self, msg_id):
+        # Кэшу нужно письмо целиком, поэтому с включенным кэшем письма запрашиваются в format='raw'
+        if Config.GMAIL_FETCH_MODE == 'full' and self.cache is None:
+            return self._get_message_details_full(msg_id)
+        return self._get_message_details_raw(msg_id)
+
+    def _get_message_details_full(self, msg_id):
+        """
+        Получает сообщение в format='full' и декодирует только текстовое тело.
+        Вложения не скачиваются: вместо данных сохраняется attachmentId,
+        содержимое загружается через load_attachment() перед отправкой.
+        """
         try:
-            message = self.service.users().messages().get(
+            message = self._execute(self.service.users().messages().get(
                 userId='me',
                 id=msg_id,
-                format='raw'
-            ).execute()
-
-            msg_str = base64.urlsafe_b64decode(message['raw'].encode('ASCII'))
-            mime_msg = email.message_from_bytes(msg_str)
-
-            # Extract basic info
-            subject = _get_header(mime_msg, 'Subject')
-            from_ = _get_header(mime_msg, 'From')
-            date = _get_header(mime_msg, 'Date')
-
-            # Extract body
-            body = _extract_body(mime_msg)
+                format='full',
+                fields=_FULL_FIELDS
+            ), 'messages.get')
+            payload = message.get('payload', {})
+
+            body = ''
+            attachments = []
+            text_parts = {}
+            for part in _walk_parts(payload):
+                mime_type = part.get('mimeType', '')
+                if mime_type.startswith('multipart/'):
+                    continue
 
-            # Extract attachments
-            attachments = self._extract_attachments(mime_msg)
+                part_body = part.get('body', {})
+                filename = part.get('filename')
+                if filename:
+                    attachments.append({
+                        'filename': filename,
+                        'mime_type': mime_type,
+                        'size': part_body.get('size', 0),
+                        'attachment_id': part_body.get('attachmentId'),
+                        'inline_data': part_body.get('data'),
+                        'message_id': msg_id
+                    })
+                elif mime_type in ('text/plain', 'text/html') and mime_type not in text_parts:
+                    text_parts[mime_type] = part
+
+            # Как и _extract_body, предпочитаем text/plain; HTML - если другого текста нет
+            text_part = text_parts.get('text/plain') or text_parts.get('text/html')
+            if text_part is None and not payload.get('parts') and not payload.get('filename'):
+                text_part = payload
+            if text_part is not None:
+                part_body = text_part.get('body', {})
+                if 'data' in part_body:
+                    data = _decode_part_data(part_body['data'])
+                elif part_body.get('attachmentId'):
+                    # Крупные текстовые части Gmail отдает так же, как вложения
+                    data = self.get_attachment_data(msg_id, part_body['attachmentId'])
+                else:
+                    data = b''
+                body = data.decode(_get_part_charset(text_part), errors='replace')
 
             return {
-                'subject': subject,
-                'from': from_,
-                'date': date,
+                'subject': _decode_header_value(_get_part_header(payload, 'Subject')),
+                'from': _decode_header_value(_get_part_header(payload, 'From')),
+                'date': _decode_header_value(_get_part_header(payload, 'Date')),
                 'body': body,
                 'attachments': attachments,
+                'label_ids': message.get('labelIds', []),
                 'id': msg_id
             }
         except Exception as e:
-            logger.error(f"Error getting message details for {msg_id}: {e}")
+            logger.error("Error getting message details for %s: %s", msg_id, e, extra={'msg_id': msg_id})
             return None
 
-    def mark_as_read(self, msg_id):
+    def _get_message_details_raw(self, msg_id):
         try:
-            self.service.users().messages().modify(
+            cached = self.cache.get(msg_id) if self.cache is not None else None
+            if cached is not None:
+                # Содержимое письма не меняется, а метки - могут: берем их из Gmail без тела письма
+                message = self._execute(self.service.users().messages().get(
+                    userId='me',
+                    id=msg_id,
+                    format='minimal',
+                    fields=_LABEL_IDS_FIELDS
+                ), 'messages.get')
+                label_ids = message.get('labelIds', [])
+                if label_ids != cached[1]:
+                    self.cache.set_labels(msg_id, label_ids)
+                return parse_raw_message(cached[0], msg_id, label_ids)
+
+            message = self._execute(self.service.users().messages().get(
                 userId='me',
                 id=msg_id,
-                body={'removeLabelIds': ['UNREAD']}
-            ).execute()
-            logger.info(f"Marked message {msg_id} as read")
+                format='raw',
+                fields=_RAW_FIELDS
+            ), 'messages.get')
+
+            msg_str = base64.urlsafe_b64decode(message['raw'].encode('ASCII'))
+            if self.cache is not None:
+                self.cache.put(msg_id, msg_str, message.get('labelIds', []))
+            return parse_raw_message(msg_str, msg_id, message.get('labelIds', []))
+        except Exception as e:
+            logger.error("Error getting message details for %s: %s", msg_id, e, extra={'msg_id': msg_id})
+            return None
+
+    def get_attachment_data(self, msg_id, attachment_id):
+        """Скачивает содержимое вложения через messages.attachments.get"""
+        attachment = self._execute(self.service.users().messages().attachments().get(
+            userId='me',
+            messageId=msg_id,
+            id=attachment_id,
+            fields='data'
+        ), 'messages.attachments.get')
+        return _decode_part_data(attachment['data'])
+
+    def load_attachment(self, attachment):
+        """Возвращает вложение с данными, при необходимости скачивая их из Gmail"""
+        if attachment.get('data') is not None:
+            return attachment
+        if attachment.get('inline_data'):
+            data = _decode_part_data(attachment['inline_data'])
+        else:
+            data = self.get_attachment_data(attachment['message_id'], attachment['attachment_id'])
+        return {**attachment, 'data': data}
+
+    def batch_modify(self, msg_ids, add_label_ids=(), remove_label_ids=()):
+        """Меняет метки у пачки сообщений (до 1000) одним вызовом batchModify"""
+        try:
+            self._execute(self.service.users().messages().batchModify(
+                userId='me',
+                body={
+                    'ids': list(msg_ids),
+                    'addLabelIds': list(add_label_ids),
+                    'removeLabelIds': list(remove_label_ids)
+                }
+            ), 'messages.batchModify')
             return True
         except Exception as e:
-            logger.error(f"Error marking message {msg_id} as read: {e}")
+            logger.error("Error modifying %s messages: %s", len(msg_ids), e)
             return False
 
+    def _get_or_create_label(self, label_name):
+        label_id = self.get_label_id(label_name)
+        if label_id:
+            return label_id
+        label = self._execute(self.service.users().labels().create(
+            userId='me',
+            body={'name': label_name, 'labelListVisibility': 'labelShow', 'messageListVisibility': 'show'},
+            fields='id'
+        ), 'labels.create')
+        logger.info("Создана метка '%s'", label_name)
+        return label['id']
+
+    def _get_ack_body(self):
+        """Собирает изменения меток для подтверждения по Config.GMAIL_ACK_ACTIONS"""
+        if self._ack_body is None:
+            add_label_ids, remove_label_ids = [], []
+            for action in Config.GMAIL_ACK_ACTIONS:
+                if action == 'read':
+                    remove_label_ids.append('UNREAD')
+                elif action == 'archive':
+                    remove_label_ids.append('INBOX')
+                elif action.startswith('label:'):
+                    add_label_ids.append(self._get_or_create_label(action[len('label:'):]))
+                else:
+                    raise ValueError(f"Неизвестное действие подтверждения: {action}")
+            self._ack_body = (add_label_ids, remove_label_ids)
+        return self._ack_body
+
+    async def fetch_unread(self, label_names):
+        return self.get_messages_with_labels(label_names)
+
+    async def fetch_all(self, label_ids):
+        # Страницы по всем меткам запрашиваются параллельно, письмо с несколькими метками - один раз
+        # Неудавшаяся страница повторяется с растущей паузой, после _LIST_RETRIES неудач
+        # подряд выгрузка прерывается, а не продолжается молча без части писем
+        messages = {}
+        failures = {}
+        page_tokens = dict.fromkeys(label_ids)
+        while page_tokens:
+            await self.quota.wait_for_budget('messages.list', PRIORITY_BACKFILL, len(page_tokens))
+            found, page_tokens, failed = self.list_messages_by_label(page_tokens)
+            for msg_id, message in found.items():
+                messages.setdefault(msg_id, message)
+            failures = {label_id: failures.get(label_id, 0) + 1 for label_id in failed}
+            if failures:
+                label_id, attempts = max(failures.items(), key=lambda item: item[1])
+                if attempts >= _LIST_RETRIES:
+                    raise failed[label_id]
+                delay = min(2 ** attempts, _LIST_MAX_BACKOFF)
+                logger.warning("Повтор списка по меткам %s через %s с", list(failed), delay)
+                await asyncio.sleep(delay)
+        return list(messages.values())
+
+    async def fetch_message(self, msg_id):
+        return self.get_message_details(msg_id)
+
+    async def acknowledge(self, msg_id):
+        return await self.acknowledge_many([msg_id])
+
+    async def acknowledge_many(self, msg_ids):
+        try:
+            add_label_ids, remove_label_ids = self._get_ack_body()
+        except Exception as e:
+            logger.error("Error preparing acknowledgement labels: %s", e)
+            return False
+        return self.batch_modify(msg_ids, add_label_ids, remove_label_ids)
+
+    async def throttle(self, method, priority):
+        await self.quota.wait_for_budget(method, priority)
+
     @staticmethod
     def _extract_attachments(msg):
         attachments = []
-        if msg.is_multipart():
-            for part in msg.walk():
-                if part.get_content_maintype() == 'multipart':
-                    continue
-                if part.get('Content-Disposition') is None:
-                    continue
-
-                filename = part.get_filename()
-                if filename:
-                    file_data = part.get_payload(decode=True)
-                    attachments.append({
-                        'filename': filename,
-                        'data': file_data,
-                        'mime_type': part.get_content_type()
-                    })
+        for part in msg.walk():
+            if _is_attachment(part):
+                attachments.append({
+                    'filename': part.get_filename(),
+                    'data': part.get_payload(decode=True),
+                    'mime_type': part.get_content_type()
+                })
         return attachments
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Стоимость методов Gmail API в единицах квоты
+# https://developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS = {
+    'labels.list': 1,
+    'labels.get': 1,
+    'labels.create': 5,
+    'messages.list': 5,
+    'messages.get': 5,
+    'messages.modify': 5,
+    'messages.batchModify': 50,
+    'messages.attachments.get': 5,
+}
+
+# Приоритеты вызовов: чем больше число, тем меньше доля бюджета, доступная вызову
+PRIORITY_LIVE = 0
+PRIORITY_BACKFILL = 1
+PRIORITY_OPTIONAL = 2
+
+
+class GmailQuota:
+    """
+    Учет расхода квоты Gmail API в скользящем окне.
+
+    Живой опрос может расходовать весь бюджет окна, выгрузка истории - только
+    часть, оставляя запас для живых вызовов, а необязательные вызовы
+    (диагностика, статистика) выполняются, только если бюджет почти свободен.
+    """
+
+    def __init__(self, limit=None, window=None):
+        self.limit = limit or Config.GMAIL_QUOTA_LIMIT
+        self.window = window or Config.GMAIL_QUOTA_WINDOW
+        self.headroom = {
+            PRIORITY_LIVE: 1.0,
+            PRIORITY_BACKFILL: Config.GMAIL_QUOTA_BACKFILL_SHARE,
+            PRIORITY_OPTIONAL: Config.GMAIL_QUOTA_OPTIONAL_SHARE,
+        }
+        self._events = deque()  # (время, единицы)
+        self._used = 0
+        self.total_used = 0
+
+    @staticmethod
+    def cost(method):
+        return QUOTA_UNITS.get(method, 5)
+
+    def _prune(self, now):
+        while self._events and now - self._events[0][0] >= self.window:
+            _, units = self._events.popleft()
+            self._used -= units
+
+    def used(self):
+        """Единицы квоты, израсходованные за текущее окно"""
+        self._prune(time.monotonic())
+        return self._used
+
+    def charge(self, method, count=1):
+        """Записывает расход квоты на уже выполняемый вызов"""
+        units = self.cost(method) * count
+        self._events.append((time.monotonic(), units))
+        self._used += units
+        self.total_used += units
+        return units
+
+    def allows(self, method, priority=PRIORITY_LIVE, count=1):
+        """Проверяет, укладывается ли вызов в долю бюджета для данного приоритета"""
+        budget = self.limit * self.headroom[priority]
+        return self.used() + self.cost(method) * count <= budget
+
+    def try_spend(self, method, priority=PRIORITY_OPTIONAL, count=1):
+        """Списывает квоту, если бюджет позволяет; иначе вызов следует отложить"""
+        if not self.allows(method, priority, count):
+            logger.debug("Квота: вызов %s отложен (использовано %s/%s)", method, self._used, self.limit)
+            return False
+        self.charge(method, count)
+        return True
+
+    async def wait_for_budget(self, method, priority=PRIORITY_BACKFILL, count=1):
+        """Ждет, пока в окне освободится бюджет для вызова с данным приоритетом"""
+        while not self.allows(method, priority, count):
+            if not self._events:
+                # Вызов дороже всего бюджета окна - ждать бессмысленно
+                return
+            delay = self.window - (time.monotonic() - self._events[0][0])
+            await asyncio.sleep(max(delay, 0.01))
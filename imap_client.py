@@ -0,0 +1,227 @@
+import asyncio
+import base64
+import contextlib
+import logging
+import re
+import aioimaplib
+from config import Config
+from gmail_client import parse_raw_message
+from mail_source import MailSource
+from routing import label_names
+
+logger = logging.getLogger(__name__)
+
+
+class ImapError(Exception):
+    pass
+
+
+def _encode_mailbox(name):
+    """Кодирует название папки в modified UTF-7 (RFC 3501), при необходимости заключая в кавычки"""
+    result = []
+    pending = []
+
+    def flush():
+        if pending:
+            encoded = base64.b64encode(''.join(pending).encode('utf-16-be')).decode('ascii')
+            result.append('&' + encoded.rstrip('=').replace('/', ',') + '-')
+            pending.clear()
+
+    for char in name:
+        if 0x20 <= ord(char) <= 0x7e:
+            flush()
+            result.append('&-' if char == '&' else char)
+        else:
+            pending.append(char)
+    flush()
+    encoded = ''.join(result)
+    if re.search(r'[\s"\\(){%*\]]', encoded):
+        return '"' + encoded.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return encoded
+
+
+def _check(response, command):
+    if response.result != 'OK':
+        raise ImapError(f"{command}: {response.result} {response.lines}")
+    return response
+
+
+class ImapMailSource(MailSource):
+    """
+    Источник почты по IMAP с push-уведомлениями через IDLE.
+
+    Метки соответствуют папкам IMAP (у Gmail каждая метка доступна как папка),
+    ID сообщения имеет вид '<папка>:<UID>'. Используется одно постоянное соединение:
+    между опросами оно находится в IDLE на папке IMAP_IDLE_MAILBOX, и бот
+    просыпается сразу, как только сервер сообщает о новой почте. Любая другая
+    команда (например, пакетная отметка прочитанным) прерывает IDLE (DONE),
+    выполняется и возвращает соединение в IDLE, а не ждет конца ожидания.
+    """
+
+    def __init__(self):
+        self.client = None
+        self.selected = None
+        self.lock = asyncio.Lock()
+        self._pending = 0  # команды, ожидающие соединения
+        self._interrupt = asyncio.Event()  # установлен, пока есть ожидающие команды
+
+    @contextlib.asynccontextmanager
+    async def _command(self):
+        """Захватывает соединение для команды, прерывая IDLE, если он идет"""
+        self._pending += 1
+        self._interrupt.set()
+        try:
+            async with self.lock:
+                yield
+        finally:
+            self._pending -= 1
+            if not self._pending:
+                self._interrupt.clear()
+
+    def get_label_map(self):
+        # Папки не нужно заранее разрешать в ID: их названия и есть идентификаторы
+        return {name.lower(): name for name in label_names(Config.LABEL_TO_THREAD_MAPPING, Config.ROUTING_RULES)}
+
+    async def _connect(self):
+        if self.client is not None:
+            return self.client
+
+        client_class = aioimaplib.IMAP4_SSL if Config.IMAP_SSL else aioimaplib.IMAP4
+        client = client_class(host=Config.IMAP_HOST, port=Config.IMAP_PORT, timeout=Config.IMAP_TIMEOUT)
+        await client.wait_hello_from_server()
+        _check(await client.login(Config.IMAP_USER, Config.IMAP_PASSWORD), 'LOGIN')
+        logger.info("Подключено к IMAP-серверу %s:%s", Config.IMAP_HOST, Config.IMAP_PORT)
+        self.client = client
+        self.selected = None
+        return client
+
+    async def _disconnect(self):
+        client, self.client, self.selected = self.client, None, None
+        if client is not None:
+            try:
+                await client.logout()
+            except Exception:
+                pass
+
+    async def _select(self, mailbox):
+        client = await self._connect()
+        if self.selected != mailbox:
+            _check(await client.select(_encode_mailbox(mailbox)), f'SELECT {mailbox}')
+            self.selected = mailbox
+        return client
+
+    async def _search(self, mailboxes, criteria):
+        messages = []
+        async with self._command():
+            for mailbox in mailboxes:
+                try:
+                    client = await self._select(mailbox)
+                    response = _check(await client.uid_search(criteria, charset=None), 'SEARCH')
+                    uids = response.lines[0].split() if response.lines else []
+                    messages.extend({'id': f"{mailbox}:{uid.decode()}"} for uid in uids)
+                except ImapError as e:
+                    logger.error("Ошибка поиска в папке '%s': %s", mailbox, e)
+                except Exception as e:
+                    logger.error("Ошибка соединения с IMAP-сервером: %s", e)
+                    await self._disconnect()
+        return messages
+
+    async def fetch_unread(self, label_names):
+        messages = await self._search(label_names, 'UNSEEN')
+        if messages:
+            logger.info("Найдено непрочитанных сообщений: %s", len(messages))
+        else:
+            logger.info("Непрочитанных сообщений не найдено")
+        return messages
+
+    async def fetch_all(self, label_ids):
+        return await self._search(label_ids, 'ALL')
+
+    async def fetch_message(self, msg_id):
+        mailbox, uid = msg_id.rsplit(':', 1)
+        try:
+            async with self._command():
+                client = await self._select(mailbox)
+                # BODY.PEEK не ставит флаг \Seen: письмо помечается прочитанным только в acknowledge
+                response = _check(await client.uid('fetch', uid, '(BODY.PEEK[])'), 'FETCH')
+            raw = next((line for line in response.lines if isinstance(line, bytearray)), None)
+            if raw is None:
+                raise ImapError(f"сообщение {msg_id} не найдено")
+            return parse_raw_message(bytes(raw), msg_id, [mailbox])
+        except Exception as e:
+            logger.error("Error getting message details for %s: %s", msg_id, e, extra={'msg_id': msg_id})
+            if not isinstance(e, ImapError):
+                await self._disconnect()
+            return None
+
+    async def acknowledge(self, msg_id):
+        mailbox, uid = msg_id.rsplit(':', 1)
+        try:
+            async with self._command():
+                client = await self._select(mailbox)
+                _check(await client.uid('store', uid, '+FLAGS.SILENT (\\Seen)'), 'STORE')
+            logger.info("Marked message %s as read", msg_id, extra={'msg_id': msg_id})
+            return True
+        except Exception as e:
+            logger.error("Error marking message %s as read: %s", msg_id, e, extra={'msg_id': msg_id})
+            if not isinstance(e, ImapError):
+                await self._disconnect()
+            return False
+
+    async def acknowledge_many(self, msg_ids):
+        by_mailbox = {}
+        for msg_id in msg_ids:
+            mailbox, uid = msg_id.rsplit(':', 1)
+            by_mailbox.setdefault(mailbox, []).append(uid)
+        try:
+            async with self._command():
+                for mailbox, uids in by_mailbox.items():
+                    client = await self._select(mailbox)
+                    _check(await client.uid('store', ','.join(uids), '+FLAGS.SILENT (\\Seen)'), 'STORE')
+            return True
+        except Exception as e:
+            logger.error("Error marking %s messages as read: %s", len(msg_ids), e)
+            if not isinstance(e, ImapError):
+                await self._disconnect()
+            return False
+
+    async def _idle(self, client, timeout):
+        """
+        Держит соединение в IDLE до уведомления сервера, истечения timeout или
+        появления другой команды; возвращает True, если IDLE прерван командой
+        """
+        idle = await client.idle_start(timeout=timeout)
+        push = asyncio.ensure_future(client.wait_server_push(timeout=timeout))
+        interrupt = asyncio.ensure_future(self._interrupt.wait())
+        try:
+            await asyncio.wait({push, interrupt}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            push.cancel()
+            interrupt.cancel()
+            client.idle_done()
+            await asyncio.wait_for(idle, Config.IMAP_TIMEOUT)
+        if not push.done() or push.cancelled():
+            return True
+        if push.exception() is None:
+            logger.debug("IMAP IDLE: %s", push.result())
+        return False
+
+    async def wait_for_mail(self, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            while (remaining := deadline - loop.time()) > 0:
+                async with self.lock:
+                    if self._pending:
+                        # Ожидающие команды стоят в очереди к lock перед нами: пропускаем их вперед
+                        continue
+                    client = await self._select(Config.IMAP_IDLE_MAILBOX)
+                    if not client.has_capability('IDLE'):
+                        logger.warning("IMAP-сервер не поддерживает IDLE, переходим на периодический опрос")
+                        break
+                    if not await self._idle(client, remaining):
+                        return
+        except Exception as e:
+            logger.error("Ошибка ожидания новой почты через IDLE: %s", e)
+            await self._disconnect()
+        await asyncio.sleep(max(0, deadline - loop.time()))
@@ -0,0 +1,162 @@
+import csv
+import hashlib
+import logging
+import mmap
+import os
+import re
+import email.parser
+from config import Config
+from gmail_client import _get_header, parse_raw_message
+from mail_source import MailSource
+from routing import label_names
+
+logger = logging.getLogger(__name__)
+
+_HEADER_PARSER = email.parser.BytesHeaderParser()
+# mboxrd: строки тела, начинающиеся с 'From ', экранированы одним или несколькими '>'
+_ESCAPED_FROM = re.compile(rb'^>(>*From )', re.MULTILINE)
+
+
+def _header_end(data, start, end):
+    """Позиция конца блока заголовков письма (или конец письма, если тела нет)"""
+    positions = [pos for pos in (data.find(b'\n\n', start, end), data.find(b'\r\n\r\n', start, end)) if pos != -1]
+    return min(positions) if positions else end
+
+
+def _split_labels(value):
+    """Разбирает X-Gmail-Labels: метки через запятую, метки с запятой - в кавычках"""
+    if not value:
+        return []
+    return [label.strip() for label in next(csv.reader([value], skipinitialspace=True)) if label.strip()]
+
+
+def _archive_id(headers, read_raw):
+    """
+    ID письма из архива, не зависящий от самого архива: по Message-ID, а без него - по
+    SHA-256 содержимого. Так повторный или соседний импорт не путает разные письма.
+    """
+    message_id = (headers.get('Message-ID') or '').strip()
+    if message_id:
+        return f"archive:{message_id}"
+    return f"archive:sha256:{hashlib.sha256(read_raw()).hexdigest()}"
+
+
+def iter_mbox(data):
+    """
+    Находит границы писем в mbox (mmap или bytes) построчным поиском '\\nFrom '
+    без разбора содержимого. Возвращает (начало, конец) каждого письма без
+    строки-разделителя 'From ...'.
+    """
+    size = len(data)
+    boundary = 0 if data[:5] == b'From ' else data.find(b'\nFrom ')
+    while boundary != -1:
+        line_end = data.find(b'\n', boundary + 1)
+        if line_end == -1:
+            return
+        next_boundary = data.find(b'\nFrom ', line_end)
+        end = next_boundary if next_boundary != -1 else size
+        if end > line_end + 1:
+            yield line_end + 1, end
+        boundary = next_boundary
+
+
+class ArchiveMailSource(MailSource):
+    """
+    Источник почты для массового импорта истории из архива: mbox (например,
+    выгрузки Google Takeout) или каталога с файлами .eml.
+
+    mbox отображается в память (mmap) и сканируется по границам писем, в памяти
+    хранятся только смещения писем и их метки, а содержимое разбирается по одному
+    письму при fetch_message. Метки берутся из заголовка X-Gmail-Labels; письмам
+    без него назначаются default_labels. Письма уже находятся на диске, поэтому
+    подтверждать в источнике нечего.
+    """
+
+    def __init__(self, path, default_labels=()):
+        self.path = path
+        self.default_labels = list(default_labels)
+        self._file = None
+        self._data = None
+        self._index = {}  # ID письма -> (начало, конец, метки) для mbox или (путь, метки) для .eml
+
+    def get_label_map(self):
+        return {name.lower(): name for name in label_names(Config.LABEL_TO_THREAD_MAPPING, Config.ROUTING_RULES)}
+
+    def _labels(self, headers):
+        labels = _split_labels(_get_header(headers, 'X-Gmail-Labels'))
+        return labels or self.default_labels
+
+    def _open_mbox(self):
+        if self._data is None:
+            self._file = open(self.path, 'rb')
+            if os.fstat(self._file.fileno()).st_size == 0:
+                self._data = b''
+            else:
+                self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._data
+
+    def _scan_mbox(self):
+        data = self._open_mbox()
+        for start, end in iter_mbox(data):
+            headers = _HEADER_PARSER.parsebytes(data[start:_header_end(data, start, end)])
+            msg_id = _archive_id(headers, lambda: data[start:end])
+            yield msg_id, (start, end, self._labels(headers))
+
+    def _scan_directory(self):
+        for root, dirs, files in os.walk(self.path):
+            dirs.sort()
+            for name in sorted(files):
+                if not name.lower().endswith('.eml'):
+                    continue
+                path = os.path.join(root, name)
+                with open(path, 'rb') as file:
+                    raw = file.read()
+                headers = _HEADER_PARSER.parsebytes(raw)
+                yield _archive_id(headers, lambda: raw), (path, self._labels(headers))
+
+    async def fetch_unread(self, label_names):
+        return []
+
+    async def fetch_all(self, label_ids):
+        wanted = {label.lower() for label in label_ids}
+        scan = self._scan_directory() if os.path.isdir(self.path) else self._scan_mbox()
+        messages = []
+        skipped = 0
+        for msg_id, entry in scan:
+            if not wanted.intersection(label.lower() for label in entry[-1]) or msg_id in self._index:
+                skipped += 1
+                continue
+            self._index[msg_id] = entry
+            messages.append({'id': msg_id})
+        logger.info("Архив %s: писем с нужными метками %s, пропущено %s", self.path, len(messages), skipped)
+        return messages
+
+    async def fetch_message(self, msg_id):
+        try:
+            entry = self._index[msg_id]
+            if len(entry) == 3:
+                start, end, labels = entry
+                raw = _ESCAPED_FROM.sub(rb'\1', self._data[start:end])
+            else:
+                path, labels = entry
+                with open(path, 'rb') as file:
+                    raw = file.read()
+            label_map = self.get_label_map()
+            label_ids = [label_map.get(label.lower(), label) for label in labels]
+            return parse_raw_message(raw, msg_id, label_ids)
+        except Exception as e:
+            logger.error("Error getting message details for %s: %s", msg_id, e, extra={'msg_id': msg_id})
+            return None
+
+    async def acknowledge(self, msg_id):
+        return True
+
+    async def acknowledge_many(self, msg_ids):
+        return True
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        if self._file is not None:
+            self._file.close()
+        self._data = self._file = None
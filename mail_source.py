@@ -0,0 +1,59 @@
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+from config import Config
+
+
+class MailSource(ABC):
+    """
+    Источник почты для MailForwarderBot.
+
+    Записи о сообщениях - словари с ключом 'id'; fetch_message возвращает
+    детали в формате GmailClient.get_message_details (subject, from, date, body,
+    attachments, label_ids, id), поэтому бот не зависит от конкретного бэкенда.
+    """
+
+    @abstractmethod
+    def get_label_map(self) -> Dict[str, str]:
+        """Соответствие названий меток (в нижнем регистре) и их ID в источнике"""
+
+    @abstractmethod
+    async def fetch_unread(self, label_names: List[str]) -> List[Dict]:
+        """Непрочитанные сообщения с указанными метками"""
+
+    @abstractmethod
+    async def fetch_all(self, label_ids: List[str]) -> List[Dict]:
+        """Все сообщения с указанными метками (для первичной выгрузки)"""
+
+    @abstractmethod
+    async def fetch_message(self, msg_id: str) -> Optional[Dict]:
+        """Детали сообщения или None, если получить его не удалось"""
+
+    @abstractmethod
+    async def acknowledge(self, msg_id: str) -> bool:
+        """Помечает сообщение как обработанное (прочитанное)"""
+
+    async def acknowledge_many(self, msg_ids: List[str]) -> bool:
+        """Подтверждает пачку сообщений; по умолчанию - по одному"""
+        results = [await self.acknowledge(msg_id) for msg_id in msg_ids]
+        return all(results)
+
+    def load_attachment(self, attachment: Dict) -> Dict:
+        """Возвращает вложение с данными; источники с отложенной загрузкой переопределяют метод"""
+        return attachment
+
+    async def throttle(self, method: str, priority: int):
+        """Ждет, пока источник готов принять вызов с данным приоритетом (например, по квоте)"""
+
+    async def wait_for_mail(self, timeout: float):
+        """Ждет появления новой почты не дольше timeout секунд; по умолчанию - обычный опрос"""
+        await asyncio.sleep(timeout)
+
+
+def create_mail_source() -> MailSource:
+    """Создает источник почты согласно Config.MAIL_BACKEND"""
+    if Config.MAIL_BACKEND == 'imap':
+        from imap_client import ImapMailSource
+        return ImapMailSource()
+    from gmail_client import GmailClient
+    return GmailClient()
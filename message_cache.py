@@ -0,0 +1,187 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from config import Config
+from gmail_client import parse_raw_message
+from mail_source import MailSource
+
+try:
+    import zstandard
+except ImportError:  # zstd необязателен: без него письма сжимаются gzip
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    hash TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS objects_used_at ON objects (used_at);
+CREATE TABLE IF NOT EXISTS messages (
+    msg_id TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    label_ids TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_hash ON messages (hash);
+CREATE TABLE IF NOT EXISTS labels (
+    name TEXT PRIMARY KEY,
+    id TEXT NOT NULL
+);
+"""
+
+
+def _compress(raw):
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(raw), '.zst'
+    return gzip.compress(raw, compresslevel=6), '.gz'
+
+
+def _decompress(data, file):
+    if file.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError(f"для чтения {file} нужен пакет zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+class RawMessageCache:
+    """
+    Локальный кэш исходных писем (RFC 822) для повторной обработки без Gmail API.
+
+    Содержимое хранится по хэшу SHA-256 (одинаковые письма - один файл) и сжимается
+    zstd, если установлен пакет zstandard, иначе gzip. Индекс в SQLite связывает
+    Gmail ID с хэшем и метками письма. Общий размер файлов ограничен max_bytes:
+    при переполнении удаляются давно не использованные письма.
+    """
+
+    def __init__(self, path=None, max_bytes=None):
+        self.path = path or Config.MESSAGE_CACHE_DIR
+        self.max_bytes = max_bytes or Config.MESSAGE_CACHE_MAX_BYTES
+        os.makedirs(self.path, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(self.path, 'index.db'))
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(_SCHEMA)
+        self.total_bytes = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()[0]
+
+    def _object_path(self, file):
+        return os.path.join(self.path, file[:2], file)
+
+    def put(self, msg_id, raw, label_ids):
+        digest = hashlib.sha256(raw).hexdigest()
+        now = time.time()
+        with self.db:
+            if self.db.execute('UPDATE objects SET used_at = ? WHERE hash = ?', (now, digest)).rowcount == 0:
+                data, extension = _compress(raw)
+                file = digest + extension
+                path = self._object_path(file)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as out:
+                    out.write(data)
+                self.db.execute('INSERT INTO objects VALUES (?, ?, ?, ?)', (digest, file, len(data), now))
+                self.total_bytes += len(data)
+            self.db.execute(
+                'INSERT OR REPLACE INTO messages VALUES (?, ?, ?)', (msg_id, digest, json.dumps(list(label_ids)))
+            )
+        self._evict()
+
+    def get(self, msg_id):
+        """Возвращает (письмо, метки) или None, если письма нет в кэше"""
+        row = self.db.execute(
+            'SELECT o.hash, o.file, m.label_ids FROM messages m JOIN objects o ON o.hash = m.hash WHERE m.msg_id = ?',
+            (msg_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        digest, file, label_ids = row
+        try:
+            with open(self._object_path(file), 'rb') as source:
+                raw = _decompress(source.read(), file)
+        except OSError as e:
+            logger.warning("Письмо %s пропало из кэша: %s", msg_id, e, extra={'msg_id': msg_id})
+            return None
+        with self.db:
+            self.db.execute('UPDATE objects SET used_at = ? WHERE hash = ?', (time.time(), digest))
+        return raw, json.loads(label_ids)
+
+    def set_labels(self, msg_id, label_ids):
+        """Обновляет метки письма, уже сохраненного в кэше"""
+        with self.db:
+            self.db.execute('UPDATE messages SET label_ids = ? WHERE msg_id = ?', (json.dumps(list(label_ids)), msg_id))
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            row = self.db.execute('SELECT hash, file, size FROM objects ORDER BY used_at LIMIT 1').fetchone()
+            if row is None:
+                return
+            digest, file, size = row
+            with self.db:
+                self.db.execute('DELETE FROM messages WHERE hash = ?', (digest,))
+                self.db.execute('DELETE FROM objects WHERE hash = ?', (digest,))
+            try:
+                os.remove(self._object_path(file))
+            except OSError:
+                pass
+            self.total_bytes -= size
+            logger.debug("Из кэша писем вытеснен объект %s", digest)
+
+    def entries(self):
+        """Все письма в кэше: (Gmail ID, метки) в порядке добавления"""
+        rows = self.db.execute('SELECT msg_id, label_ids FROM messages ORDER BY rowid')
+        return [(msg_id, json.loads(label_ids)) for msg_id, label_ids in rows]
+
+    def save_label_map(self, label_map):
+        """Запоминает соответствие названий и ID меток для работы без Gmail"""
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO labels VALUES (?, ?)', label_map.items())
+
+    def label_map(self):
+        return dict(self.db.execute('SELECT name, id FROM labels'))
+
+    def close(self):
+        self.db.close()
+
+
+class CachedMailSource(MailSource):
+    """
+    Источник почты, читающий только из RawMessageCache: для повторной обработки
+    ранее полученных писем (например, после изменения правил разбора) без
+    обращений к Gmail API и расхода квоты.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache or RawMessageCache()
+        self.path = self.cache.path
+
+    def get_label_map(self):
+        return self.cache.label_map()
+
+    async def fetch_unread(self, label_names):
+        return []
+
+    async def fetch_all(self, label_ids):
+        wanted = set(label_ids)
+        return [{'id': msg_id} for msg_id, labels in self.cache.entries() if wanted.intersection(labels)]
+
+    async def fetch_message(self, msg_id):
+        cached = self.cache.get(msg_id)
+        if cached is None:
+            logger.error("Сообщение %s не найдено в кэше", msg_id, extra={'msg_id': msg_id})
+            return None
+        raw, label_ids = cached
+        return parse_raw_message(raw, msg_id, label_ids)
+
+    async def acknowledge(self, msg_id):
+        return True
+
+    async def acknowledge_many(self, msg_ids):
+        return True
+
+    def close(self):
+        self.cache.close()
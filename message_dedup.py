@@ -0,0 +1,88 @@
+import hashlib
+import logging
+import re
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(value):
+    return re.sub(r'\s+', ' ', str(value or '')).strip().lower()
+
+
+def _message_timestamp(message_details):
+    """Время письма из заголовка Date; если его нет или он битый - текущее время"""
+    try:
+        return parsedate_to_datetime(message_details.get('date', '')).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+class ContentDeduplicator:
+    """
+    Индекс отпечатков содержимого для отсечения повторных уведомлений банка.
+
+    Отпечаток строится не по Gmail ID, а по содержимому, поэтому ловит и повторно
+    присланные письма, и одно письмо с несколькими метками. По разобранным полям
+    (тип, сумма, счет, контрагент, остаток, номер) сравниваются только платежи с
+    номером или остатком: они отличают новый платеж на ту же сумму от повтора.
+    Остальные письма (СБП, операции по карте без остатка, нераспознанные)
+    сравниваются по точному тексту и в коротком окне text_window, чтобы два
+    настоящих одинаковых перевода не склеились. Повтором считается письмо с тем
+    же отпечатком, пришедшее в пределах окна от предыдущего.
+    """
+
+    def __init__(self, window=None, max_size=None, text_window=None):
+        self.window = Config.DEDUP_WINDOW if window is None else window
+        self.text_window = Config.DEDUP_TEXT_WINDOW if text_window is None else text_window
+        self.max_size = max_size or Config.DEDUP_MAX_SIZE
+        self._seen = OrderedDict()  # отпечаток -> время письма
+        self.suppressed = 0
+
+    @staticmethod
+    def _has_unique_fields(parsed):
+        """Есть ли у платежа поля, отличающие его от другого платежа на ту же сумму"""
+        data = parsed['data']
+        return (
+            parsed['type'] not in ('unknown', 'raw') and bool(data.get('amount'))
+            and bool(data.get('number') or data.get('balance'))
+        )
+
+    @staticmethod
+    def fingerprint(parsed):
+        data = parsed['data']
+        if not ContentDeduplicator._has_unique_fields(parsed):
+            # Без номера и остатка сравниваем по точному нормализованному тексту
+            key = f"text|{_normalize(parsed['text'])}"
+        else:
+            key = '|'.join([
+                parsed['type'],
+                re.sub(r'\s', '', data['amount']),
+                _normalize(data.get('account') or data.get('card')),
+                _normalize(data.get('sender') or data.get('recipient') or data.get('place')),
+                re.sub(r'\s', '', data.get('balance', '')),
+                data.get('number', ''),
+            ])
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def is_duplicate(self, parsed, message_details):
+        """Проверяет письмо на повтор и запоминает его отпечаток"""
+        if not self.window or parsed is None:
+            return False
+
+        fingerprint = self.fingerprint(parsed)
+        window = self.window if self._has_unique_fields(parsed) else min(self.window, self.text_window)
+        timestamp = _message_timestamp(message_details)
+        previous = self._seen.get(fingerprint)
+        if previous is not None and abs(timestamp - previous) <= window:
+            self.suppressed += 1
+            return True
+
+        self._seen[fingerprint] = timestamp
+        self._seen.move_to_end(fingerprint)
+        while len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+        return False
@@ -0,0 +1,226 @@
+import logging
+import os
+import re
+import sqlite3
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from email.utils import parsedate_to_datetime
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Направление движения денег по типу сообщения из TelegramClient.parse_message
+_INFLOW_TYPES = {'incoming'}
+_OUTFLOW_TYPES = {'sbp', 'payment'}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS payments (
+    msg_id TEXT PRIMARY KEY,
+    day TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    balance INTEGER,
+    account TEXT NOT NULL,
+    counterparty TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS day_totals (
+    day TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    inflow INTEGER NOT NULL,
+    outflow INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS account_totals (
+    day TEXT NOT NULL,
+    account TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    inflow INTEGER NOT NULL,
+    outflow INTEGER NOT NULL,
+    balance INTEGER,
+    balance_ts INTEGER NOT NULL,
+    PRIMARY KEY (day, account)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS topic_totals (
+    day TEXT NOT NULL,
+    thread_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    inflow INTEGER NOT NULL,
+    outflow INTEGER NOT NULL,
+    PRIMARY KEY (day, thread_id)
+) WITHOUT ROWID;
+"""
+
+_UPSERT_DAY = """
+INSERT INTO day_totals (day, count, inflow, outflow) VALUES (?, 1, ?, ?)
+ON CONFLICT (day) DO UPDATE SET
+    count = count + 1, inflow = inflow + excluded.inflow, outflow = outflow + excluded.outflow
+"""
+
+_UPSERT_TOPIC = """
+INSERT INTO topic_totals (day, thread_id, count, inflow, outflow) VALUES (?, ?, 1, ?, ?)
+ON CONFLICT (day, thread_id) DO UPDATE SET
+    count = count + 1, inflow = inflow + excluded.inflow, outflow = outflow + excluded.outflow
+"""
+
+_UPSERT_ACCOUNT = """
+INSERT INTO account_totals (day, account, count, inflow, outflow, balance, balance_ts) VALUES (?, ?, 1, ?, ?, ?, ?)
+ON CONFLICT (day, account) DO UPDATE SET
+    count = count + 1, inflow = inflow + excluded.inflow, outflow = outflow + excluded.outflow,
+    balance = CASE WHEN excluded.balance IS NOT NULL AND excluded.balance_ts >= balance_ts
+                   THEN excluded.balance ELSE balance END,
+    balance_ts = CASE WHEN excluded.balance IS NOT NULL AND excluded.balance_ts >= balance_ts
+                      THEN excluded.balance_ts ELSE balance_ts END
+"""
+
+
+def to_kopecks(value):
+    """Переводит сумму вида '10 000,50' в копейки; None, если сумму не удалось разобрать"""
+    if not value:
+        return None
+    try:
+        return int(Decimal(re.sub(r'\s', '', str(value)).replace(',', '.')) * 100)
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def format_kopecks(value):
+    return f"{value / 100:,.2f}".replace(',', ' ').replace('.', ',')
+
+
+def _direction(message_type, data):
+    """Возвращает (поступление, списание) как множители суммы"""
+    if message_type in _INFLOW_TYPES:
+        return 1, 0
+    if message_type in _OUTFLOW_TYPES:
+        return 0, 1
+    if message_type == 'card':
+        return (1, 0) if data.get('operation', '').lower() == 'пополнение' else (0, 1)
+    return None
+
+
+def _message_time(message_details):
+    """Локальное время письма из заголовка Date; если его нет - текущее"""
+    try:
+        return parsedate_to_datetime(message_details.get('date', '')).astimezone()
+    except (TypeError, ValueError):
+        return datetime.now().astimezone()
+
+
+class PaymentStore:
+    """
+    Локальное хранилище разобранных платежей (SQLite) со сводками по дням,
+    счетам и топикам.
+
+    Сводки обновляются инкрементально (UPSERT) в той же транзакции, что и запись
+    платежа, поэтому получение итогов - чтение одной строки по первичному ключу:
+    ни историческую почту, ни сами платежи повторно разбирать не нужно. Суммы
+    хранятся в копейках. Письмо учитывается один раз: повторная запись того же
+    msg_id (например, при выгрузке истории после перезапуска) игнорируется.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or Config.PAYMENTS_DB
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(_SCHEMA)
+
+    def record(self, msg_id, parsed, message_details, thread_ids):
+        """Сохраняет платеж и обновляет сводки; возвращает True, если платеж записан впервые"""
+        if not parsed:
+            return False
+        data = parsed.get('data') or {}
+        direction = _direction(parsed['type'], data)
+        amount = to_kopecks(data.get('amount'))
+        if direction is None or amount is None:
+            return False
+
+        moment = _message_time(message_details)
+        day = moment.date().isoformat()
+        ts = int(moment.timestamp())
+        inflow, outflow = direction[0] * amount, direction[1] * amount
+        balance = to_kopecks(data.get('balance'))
+        account = data.get('account') or data.get('card') or ''
+        counterparty = data.get('sender') or data.get('recipient') or data.get('place') or ''
+
+        with self.db:
+            inserted = self.db.execute(
+                'INSERT OR IGNORE INTO payments VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (msg_id, day, ts, parsed['type'], amount, balance, account, counterparty)
+            ).rowcount
+            if not inserted:
+                return False
+            self.db.execute(_UPSERT_DAY, (day, inflow, outflow))
+            self.db.execute(_UPSERT_ACCOUNT, (day, account, inflow, outflow, balance, ts))
+            for thread_id in set(thread_ids):
+                self.db.execute(_UPSERT_TOPIC, (day, thread_id, inflow, outflow))
+        logger.debug("Платеж %s сохранен в сводки за %s", msg_id, day, extra={'msg_id': msg_id})
+        return True
+
+    def _totals(self, query, params):
+        row = self.db.execute(query, params).fetchone()
+        if row is None:
+            return {'count': 0, 'inflow': 0, 'outflow': 0}
+        return dict(zip(('count', 'inflow', 'outflow'), row))
+
+    def day_summary(self, day):
+        return self._totals('SELECT count, inflow, outflow FROM day_totals WHERE day = ?', (day,))
+
+    def topic_summary(self, day, thread_id):
+        return self._totals(
+            'SELECT count, inflow, outflow FROM topic_totals WHERE day = ? AND thread_id = ?', (day, thread_id)
+        )
+
+    def account_summaries(self, day):
+        """Сводки по счетам за день: {счет: {'count', 'inflow', 'outflow', 'balance'}}"""
+        rows = self.db.execute(
+            'SELECT account, count, inflow, outflow, balance FROM account_totals WHERE day = ?', (day,)
+        )
+        return {row[0]: dict(zip(('count', 'inflow', 'outflow', 'balance'), row[1:])) for row in rows}
+
+    def active_topics(self, day):
+        """Топики, в которые за день были отправлены платежи"""
+        return [row[0] for row in self.db.execute('SELECT thread_id FROM topic_totals WHERE day = ?', (day,))]
+
+    def close(self):
+        self.db.close()
+
+
+def format_digest(day, summary, accounts=None):
+    """
+    Текст сводки за день для Telegram (MarkdownV2); accounts - сводки по счетам из
+    PaymentStore.account_summaries, если их нужно добавить
+    """
+    def escape_md(text):
+        return re.sub(r'([_*\[\]()~`>#+\-=|{}.!])', r'\\\1', str(text))
+
+    title = datetime.strptime(day, '%Y-%m-%d').strftime('%d.%m.%Y')
+    lines = [
+        f"*Итоги за {escape_md(title)}*",
+        f"Операций: {summary['count']}",
+        f"Поступления: {escape_md(format_kopecks(summary['inflow']))} ₽",
+        f"Списания: {escape_md(format_kopecks(summary['outflow']))} ₽",
+    ]
+    if accounts:
+        lines.append("*По счетам:*")
+        for account, totals in sorted(accounts.items()):
+            line = (
+                f"{escape_md(account or 'без счета')}: "
+                f"{escape_md('+' + format_kopecks(totals['inflow']))} ₽ / "
+                f"{escape_md('-' + format_kopecks(totals['outflow']))} ₽"
+            )
+            if totals['balance'] is not None:
+                line += f", остаток {escape_md(format_kopecks(totals['balance']))} ₽"
+            lines.append(line)
+    return '\n'.join(lines)
+
+
+def seconds_until(time_of_day, now=None):
+    """Секунд до ближайшего наступления времени 'ЧЧ:ММ'"""
+    now = now or datetime.now()
+    hours, minutes = (int(part) for part in time_of_day.split(':'))
+    target = now.replace(hour=hours, minute=minutes, second=0, microsecond=0)
+    delay = (target - now).total_seconds()
+    return delay if delay > 0 else delay + 24 * 3600
@@ -0,0 +1,95 @@
+import logging
+import re
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def label_names(mapping: Dict, rules: List[Dict]) -> List[str]:
+    """Названия всех меток из соответствия меток и топиков и из правил маршрутизации"""
+    names = list(mapping)
+    for rule in rules:
+        names.extend(name for name in _as_list(rule.get('labels')) if name not in names)
+    return names
+
+
+class RoutingRule:
+    """
+    Дополнительное правило маршрутизации. Все заданные условия должны выполняться:
+    from / subject - регулярные выражения (без учета регистра),
+    type - тип сообщения из TelegramClient.parse_message (строка или список),
+    labels - названия меток, хотя бы одна из которых должна быть на письме.
+    """
+
+    def __init__(self, rule: Dict, label_map: Dict[str, str]):
+        self.sender = re.compile(rule['from'], re.IGNORECASE) if rule.get('from') else None
+        self.subject = re.compile(rule['subject'], re.IGNORECASE) if rule.get('subject') else None
+        self.types = set(_as_list(rule.get('type')))
+        names = _as_list(rule.get('labels'))
+        self.label_ids = {label_map[name.lower()] for name in names if name.lower() in label_map}
+        self.missing_labels = [name for name in names if name.lower() not in label_map]
+        self.requires_labels = bool(rule.get('labels'))
+        self.thread_ids = [int(thread_id) for thread_id in _as_list(rule['threads'])]
+
+    def matches(self, message_details, label_ids, message_type):
+        if self.requires_labels and not self.label_ids.intersection(label_ids):
+            return False
+        if self.types and message_type not in self.types:
+            return False
+        if self.sender and not self.sender.search(message_details.get('from', '')):
+            return False
+        if self.subject and not self.subject.search(message_details.get('subject', '')):
+            return False
+        return True
+
+
+class MessageRouter:
+    """
+    Маршрутизация писем по топикам Telegram.
+
+    Соответствие меток и топиков компилируется один раз при запуске в словарь
+    ID метки -> список топиков, поэтому выбор топиков не требует обращений к Gmail.
+    Значение в LABEL_TO_THREAD_MAPPING может быть числом или списком топиков.
+    """
+
+    def __init__(self, mapping: Dict, rules: List[Dict], label_map: Dict[str, str]):
+        self.label_to_threads = {}
+        self.missing_labels = []
+        for label_name, thread_ids in mapping.items():
+            label_id = label_map.get(label_name.lower())
+            if not label_id:
+                self.missing_labels.append(label_name)
+                continue
+            targets = self.label_to_threads.setdefault(label_id, [])
+            targets.extend(int(thread_id) for thread_id in _as_list(thread_ids) if int(thread_id) not in targets)
+
+        self.rules = [RoutingRule(rule, label_map) for rule in rules]
+        # Ненайденная метка в правиле тоже ошибка: такое правило никогда не сработает
+        for rule in self.rules:
+            self.missing_labels.extend(name for name in rule.missing_labels if name not in self.missing_labels)
+
+    @property
+    def label_ids(self):
+        """ID всех меток, по которым ведется маршрутизация"""
+        return list(self.label_to_threads)
+
+    def route(self, message_details, message_type=None) -> List[int]:
+        """Возвращает список топиков для письма (пустой, если соответствий нет)"""
+        label_ids = message_details.get('label_ids', [])
+        thread_ids = []
+        for label_id in label_ids:
+            for thread_id in self.label_to_threads.get(label_id, ()):
+                if thread_id not in thread_ids:
+                    thread_ids.append(thread_id)
+
+        for rule in self.rules:
+            if rule.matches(message_details, label_ids, message_type):
+                thread_ids.extend(t for t in rule.thread_ids if t not in thread_ids)
+
+        return thread_ids
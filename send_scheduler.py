@@ -0,0 +1,146 @@
+import asyncio
+import logging
+from collections import deque
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+LANE_LIVE = 'live'
+LANE_BACKFILL = 'backfill'
+LANE_RETRY = 'retry'
+LANES = (LANE_LIVE, LANE_RETRY, LANE_BACKFILL)
+
+
+class LaneFull(Exception):
+    pass
+
+
+class Delivery:
+    """
+    Элемент очереди отправки: одно письмо для одного топика - текст и вложения.
+    Части отправляются по порядку, поэтому вложения не обгоняют свой текст;
+    sent хранит число уже отправленных частей, и повтор продолжает с места сбоя.
+    not_before - время цикла событий, раньше которого элемент не выдается.
+    """
+
+    def __init__(self, thread_id, text=None, attachments=(), msg_id=None):
+        self.thread_id = thread_id
+        self.parts = ([text] if text is not None else []) + list(attachments)
+        self.msg_id = msg_id
+        self.sent = 0
+        self.attempts = 0
+        self.not_before = 0
+
+    @property
+    def done(self):
+        return self.sent >= len(self.parts)
+
+
+class SendScheduler:
+    """
+    Очередь отправки с несколькими полосами (живые письма, выгрузка истории,
+    повторы). Полосы обслуживаются взвешенным циклическим перебором
+    (smooth weighted round-robin), поэтому живое письмо ждет не дольше нескольких
+    отправок, как бы велик ни был накопившийся хвост выгрузки. Для полос можно
+    задать предельную глубину: put() на заполненной полосе ждет освобождения места.
+    Элемент с not_before в будущем (отложенный повтор) не задерживает другие
+    полосы: его полоса просто не участвует в выборе, пока не наступит срок.
+    """
+
+    def __init__(self, weights=None, limits=None):
+        weights = weights or Config.SEND_LANE_WEIGHTS
+        limits = limits or Config.SEND_LANE_LIMITS
+        self.weights = {lane: max(int(weights.get(lane, 1)), 1) for lane in LANES}
+        self.limits = {lane: int(limits.get(lane, 0)) for lane in LANES}  # 0 - без ограничения
+        self.lanes = {lane: deque() for lane in LANES}
+        self._current = {lane: 0 for lane in LANES}
+        self._changed = asyncio.Condition()
+        self._unfinished = 0
+        self._done = asyncio.Event()
+        self._done.set()
+
+    def qsize(self, lane=None):
+        if lane is not None:
+            return len(self.lanes[lane])
+        return sum(len(queue) for queue in self.lanes.values())
+
+    def _is_full(self, lane):
+        return self.limits[lane] and len(self.lanes[lane]) >= self.limits[lane]
+
+    def _append(self, item, lane, front=False):
+        if front:
+            self.lanes[lane].appendleft(item)
+        else:
+            self.lanes[lane].append(item)
+        self._unfinished += 1
+        self._done.clear()
+
+    def _due_in(self, lane, now):
+        """Через сколько секунд можно выдать первый элемент полосы (None - полоса пуста)"""
+        if not self.lanes[lane]:
+            return None
+        return max(getattr(self.lanes[lane][0], 'not_before', 0) - now, 0)
+
+    async def put(self, item, lane=LANE_LIVE):
+        async with self._changed:
+            await self._changed.wait_for(lambda: not self._is_full(lane))
+            self._append(item, lane)
+            self._changed.notify_all()
+
+    def put_nowait(self, item, lane=LANE_LIVE):
+        """Добавляет элемент без ожидания; на заполненной полосе выбрасывает LaneFull"""
+        if self._is_full(lane):
+            raise LaneFull(lane)
+        self._append(item, lane)
+        asyncio.ensure_future(self._notify())
+
+    def put_front_nowait(self, item, lane):
+        """
+        Возвращает только что выданный элемент в начало его полосы (без проверки
+        глубины: место под него уже было)
+        """
+        self._append(item, lane, front=True)
+        asyncio.ensure_future(self._notify())
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    def _pick_lane(self, ready):
+        total = sum(self.weights[lane] for lane in ready)
+        for lane in LANES:
+            # Пустая или ждущая срока полоса не копит кредит, иначе после простоя она забрала бы серию отправок
+            self._current[lane] = self._current[lane] + self.weights[lane] if lane in ready else 0
+        chosen = max(ready, key=lambda lane: self._current[lane])
+        self._current[chosen] -= total
+        return chosen
+
+    async def get(self):
+        """Возвращает (полоса, элемент) следующей по очереди отправки"""
+        loop = asyncio.get_running_loop()
+        async with self._changed:
+            while True:
+                now = loop.time()
+                delays = [delay for delay in (self._due_in(lane, now) for lane in LANES) if delay is not None]
+                ready = [lane for lane in LANES if self._due_in(lane, now) == 0]
+                if ready:
+                    break
+                try:
+                    # Ждем нового элемента или срока ближайшего отложенного
+                    await asyncio.wait_for(self._changed.wait(), min(delays) if delays else None)
+                except asyncio.TimeoutError:
+                    pass
+            lane = self._pick_lane(ready)
+            item = self.lanes[lane].popleft()
+            self._changed.notify_all()
+            return lane, item
+
+    def task_done(self):
+        self._unfinished -= 1
+        if self._unfinished <= 0:
+            self._unfinished = 0
+            self._done.set()
+
+    async def join(self):
+        """Ждет, пока все поставленные элементы будут обработаны"""
+        await self._done.wait()
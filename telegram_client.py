@@ -3,65 +3,156 @@ from telegram.error import TelegramError
 from telegram.request import HTTPXRequest
 from bs4 import BeautifulSoup
 from config import Config
+from file_id_cache import FileIdCache, content_digest
+import asyncio
+import httpx
 import logging
-from io import BytesIO
 import re
+import time
 logger = logging.getLogger(__name__)
 
 
+def create_request():
+    """
+    HTTP-транспорт для Bot API: HTTP/2 позволяет мультиплексировать параллельные
+    отправки в одном соединении, а увеличенный keepalive_expiry не дает пулу
+    закрывать соединения между отправками.
+    """
+    return HTTPXRequest(
+        connection_pool_size=Config.TELEGRAM_POOL_SIZE,
+        http_version='2' if Config.TELEGRAM_HTTP2 else '1.1',
+        connect_timeout=Config.TELEGRAM_CONNECT_TIMEOUT,
+        read_timeout=Config.TELEGRAM_READ_TIMEOUT,
+        write_timeout=Config.TELEGRAM_WRITE_TIMEOUT,
+        pool_timeout=Config.TELEGRAM_POOL_TIMEOUT,
+        media_write_timeout=Config.TELEGRAM_MEDIA_TIMEOUT,
+        httpx_kwargs={
+            'limits': httpx.Limits(
+                max_connections=Config.TELEGRAM_POOL_SIZE,
+                max_keepalive_connections=Config.TELEGRAM_POOL_SIZE,
+                keepalive_expiry=Config.TELEGRAM_KEEPALIVE_EXPIRY,
+            ),
+        },
+    )
+
+
 class TelegramClient:
     def __init__(self):
-        self.trequest = HTTPXRequest(connection_pool_size=20)
-        self.bot = Bot(token=Config.TELEGRAM_BOT_TOKEN, request=self.trequest)
+        self.trequest = create_request()
+        self.bot = Bot(token=Config.TELEGRAM_BOT_TOKEN, request=self.trequest, base_url=Config.TELEGRAM_API_URL)
         self.group_id = Config.TELEGRAM_GROUP_ID
+        self.last_request_time = 0.0
+        self.file_ids = FileIdCache() if Config.FILE_ID_CACHE else None
+
+    async def warm_up(self):
+        """Заранее устанавливает соединение (DNS, TCP, TLS), чтобы первая отправка не ждала его"""
+        try:
+            await self.bot.initialize()
+            self.last_request_time = time.monotonic()
+            logger.info("Соединение с Telegram Bot API установлено")
+        except TelegramError as e:
+            logger.error("Не удалось установить соединение с Telegram: %s", e)
+
+    async def keep_alive(self):
+        """Поддерживает соединение открытым, отправляя getMe, если долго не было запросов"""
+        interval = Config.TELEGRAM_KEEPALIVE_INTERVAL
+        while True:
+            idle_for = time.monotonic() - self.last_request_time
+            if idle_for < interval:
+                await asyncio.sleep(interval - idle_for)
+                continue
+            try:
+                await self.bot.get_me(read_timeout=Config.TELEGRAM_READ_TIMEOUT)
+            except TelegramError as e:
+                logger.warning("Проверка соединения с Telegram не удалась: %s", e)
+            self.last_request_time = time.monotonic()
 
     async def send_message_to_thread(self, thread_id, text):
         try:
+            self.last_request_time = time.monotonic()
             message = await self.bot.send_message(
                 chat_id=self.group_id,
                 text=text,
                 message_thread_id=thread_id,
                 parse_mode='MarkdownV2',
-
+                read_timeout=Config.TELEGRAM_READ_TIMEOUT,
+                write_timeout=Config.TELEGRAM_WRITE_TIMEOUT,
             )
-            logger.info(f"Сообщение отправлено в топик {thread_id}")
+            logger.info("Сообщение отправлено в топик %s", thread_id, extra={'thread_id': thread_id})
             return message
         except TelegramError as e:
-            logger.error(f"Ошибка отправки сообщения в топик {thread_id}: {e}")
+            logger.error("Ошибка отправки сообщения в топик %s: %s", thread_id, e, extra={'thread_id': thread_id})
             return None
 
+    async def _send_file(self, kind, thread_id, file, attachment):
+        """Отправляет файл (InputFile или file_id) фото или документом"""
+        timeouts = {
+            'read_timeout': Config.TELEGRAM_MEDIA_TIMEOUT,
+            'write_timeout': Config.TELEGRAM_MEDIA_TIMEOUT,
+        }
+        if kind == 'photo':
+            return await self.bot.send_photo(
+                chat_id=self.group_id,
+                photo=file,
+                message_thread_id=thread_id,
+                **timeouts
+            )
+        if attachment['mime_type'] == 'application/pdf':
+            return await self.bot.send_document(
+                chat_id=self.group_id,
+                document=file,
+                message_thread_id=thread_id,
+                **timeouts
+            )
+        return await self.bot.send_document(
+            chat_id=self.group_id,
+            document=file,
+            message_thread_id=thread_id,
+            caption=f"Файл: {attachment['filename']}",
+            **timeouts
+        )
+
     async def send_attachment_to_thread(self, thread_id, attachment):
-        try:
-            file = BytesIO(attachment['data'])
-            file.name = attachment['filename']
-
-            if attachment['mime_type'].startswith('image/'):
-                sent_msg = await self.bot.send_photo(
-                    chat_id=self.group_id,
-                    photo=InputFile(file),
-                    message_thread_id=thread_id
-                )
-            elif attachment['mime_type'] == 'application/pdf':
-                sent_msg = await self.bot.send_document(
-                    chat_id=self.group_id,
-                    document=InputFile(file),
-                    message_thread_id=thread_id
-                )
-            else:
-                sent_msg = await self.bot.send_document(
-                    chat_id=self.group_id,
-                    document=InputFile(file),
-                    message_thread_id=thread_id,
-                    caption=f"Файл: {attachment['filename']}"
+        """
+        Отправляет вложение из attachment['data'] (bytes). Уже загруженный однажды файл
+        (по хэшу содержимого) отправляется по file_id без загрузки.
+        """
+        kind = 'photo' if attachment['mime_type'].startswith('image/') else 'document'
+        log_extra = {'msg_id': attachment.get('message_id'), 'thread_id': thread_id}
+        digest = content_digest(attachment) if self.file_ids is not None else None
+
+        file_id = self.file_ids.get(kind, digest) if digest else None
+        if file_id:
+            try:
+                self.last_request_time = time.monotonic()
+                sent_msg = await self._send_file(kind, thread_id, file_id, attachment)
+                logger.info(
+                    "Вложение %s отправлено в топик %s по file_id", attachment['filename'], thread_id, extra=log_extra
                 )
+                return sent_msg
+            except TelegramError as e:
+                # file_id мог устареть - забываем его и загружаем файл заново
+                logger.warning("Не удалось отправить вложение по file_id, загружаем заново: %s", e, extra=log_extra)
+                self.file_ids.evict(kind, digest)
 
-            logger.info(f"Вложение {attachment['filename']} отправлено в топик {thread_id}")
+        try:
+            self.last_request_time = time.monotonic()
+            input_file = InputFile(attachment['data'], filename=attachment['filename'])
+            sent_msg = await self._send_file(kind, thread_id, input_file, attachment)
+
+            logger.info(
+                "Вложение %s отправлено в топик %s", attachment['filename'], thread_id, extra=log_extra
+            )
+            if digest:
+                sent_file = sent_msg.photo[-1] if kind == 'photo' and sent_msg.photo else sent_msg.document
+                if sent_file is not None:
+                    self.file_ids.put(kind, digest, sent_file.file_id)
             return sent_msg
         except TelegramError as e:
-            logger.error(f"Ошибка отправки вложения в топик {thread_id}: {e}")
+            logger.error("Ошибка отправки вложения в топик %s: %s", thread_id, e, extra={'thread_id': thread_id})
             return None
 
-    def format_message(self, message_details):
+    def format_message(self, message_details, parsed=None):
         """
         Основной метод форматирования сообщения с автоматическим определением типа
         Поддерживает:
@@ -70,11 +161,48 @@ class TelegramClient:
         - Входящие зачисления
         - Переводы через СБП
         - Любые другие сообщения (выводит как есть)
+
+        Если сообщение уже разобрано через parse_message, результат можно передать в parsed,
+        чтобы не разбирать его повторно.
+        """
+        try:
+            if parsed is None:
+                parsed = self.parse_message(message_details)
+            if parsed is None:
+                return "Ошибка: отсутствует тело сообщения или неверный формат"
+
+            message_type = parsed['type']
+            payment_data = parsed['data']
+            if message_type == 'incoming':
+                return self._create_incoming_payment_message(payment_data)
+            elif message_type == 'sbp':
+                return self._create_sbp_payment_message(payment_data)
+            elif message_type == 'card':
+                return self._create_card_operation_message(payment_data)
+            elif message_type == 'payment':
+                try:
+                    return self._create_payment_message(payment_data)
+                except Exception:
+                    return self._escape_text(parsed['text'])
+            else:
+                # Если не удалось извлечь ключевые данные, возвращаем оригинальный текст в экранированном виде
+                return self._escape_text(parsed['text'])
+
+        except Exception:
+            logger.exception("Ошибка при форматировании сообщения %s", message_details.get('id'),
+                             extra={'msg_id': message_details.get('id')})
+            return self._escape_text(message_details.get('body', 'Не удалось обработать сообщение'))
+
+    def parse_message(self, message_details):
+        """
+        Определяет тип сообщения и извлекает данные платежа.
+        Возвращает словарь {'type', 'data', 'text'} или None, если у сообщения нет тела.
+        Типы: incoming, sbp, card, payment, unknown (не удалось распознать) и raw (ошибка разбора).
         """
         try:
             body = message_details.get('body', '')
             if not body or not isinstance(body, str):
-                return "Ошибка: отсутствует тело сообщения или неверный формат"
+                return None
 
             # Очистка и нормализация текста
             body = self._preprocess_html(body)
@@ -84,31 +212,30 @@ class TelegramClient:
 
             # Определяем тип сообщения (ВАЖНО: порядок проверки имеет значение!)
             if self._is_incoming_payment(text):
-                payment_data = self._parse_incoming_payment(text)
-                return self._create_incoming_payment_message(payment_data)
+                return {'type': 'incoming', 'data': self._parse_incoming_payment(text), 'text': text}
             elif self._is_sbp_payment(text):  # Проверяем СБП ДО карточных операций!
-                payment_data = self._parse_sbp_payment(text)
-                return self._create_sbp_payment_message(payment_data)
+                return {'type': 'sbp', 'data': self._parse_sbp_payment(text), 'text': text}
             elif self._is_card_operation(text):
-                payment_data = self._parse_card_operation(text)
-                return self._create_card_operation_message(payment_data)
+                return {'type': 'card', 'data': self._parse_card_operation(text), 'text': text}
             else:
                 try:
                     # Пробуем распарсить как обычный платеж
                     payment_data = self._parse_payment_text(text)
-                    formatted = self._create_payment_message(payment_data)
-
-                    if payment_data.get('amount') and payment_data.get('recipient'):
-                        return formatted
-                    else:
-                        # Если не удалось извлечь ключевые данные, возвращаем оригинальный текст в экранированном виде
-                        return self._escape_markdown(text)
                 except Exception:
-                    return self._escape_markdown(text)
+                    return {'type': 'unknown', 'data': {}, 'text': text}
+
+                if payment_data.get('amount') and payment_data.get('recipient'):
+                    return {'type': 'payment', 'data': payment_data, 'text': text}
+                return {'type': 'unknown', 'data': payment_data, 'text': text}
 
-        except Exception as e:
-            print(f"Ошибка при обработке сообщения: {e}")
-            return self._escape_markdown(message_details.get('body', 'Не удалось обработать сообщение'))
+        except Exception:
+            logger.exception("Ошибка при разборе сообщения %s", message_details.get('id'),
+                             extra={'msg_id': message_details.get('id')})
+            return {
+                'type': 'raw',
+                'data': {},
+                'text': message_details.get('body', 'Не удалось обработать сообщение')
+            }
 
     def _is_card_operation(self, text):
         """Определяет, является ли сообщение операцией по карте"""
@@ -177,6 +304,11 @@ class TelegramClient:
         """Парсит данные для входящих платежей"""
         payment_data = {}
 
+        # Номер платежа
+        number_match = re.search(r'[Пп]лат[её]ж №\s*(\d+)', text)
+        if number_match:
+            payment_data['number'] = number_match.group(1)
+
         # Сумма платежа
         amount_match = re.search(r'платёж №\d+ на ([\d \.,]+) RUB', text) or \
                        re.search(r'Сумма платежа — ([\d \.,]+) RUB', text) or \
@@ -439,6 +571,18 @@ class TelegramClient:
         except:
             return num_str
 
+    def _escape_text(self, text):
+        """Экранирует исходный текст письма и обрезает его до MAX_MESSAGE_LENGTH символов"""
+        escaped = self._escape_markdown(text)
+        limit = Config.MAX_MESSAGE_LENGTH
+        if len(escaped) <= limit:
+            return escaped
+        cut = escaped[:limit - 1]
+        # Не оставляем в конце одиночный '\' от разрезанной экранированной пары
+        if (len(cut) - len(cut.rstrip('\\'))) % 2:
+            cut = cut[:-1]
+        return cut + '…'
+
     def _escape_markdown(self, text):
         """Экранирует специальные символы MarkdownV2"""
         if not text:
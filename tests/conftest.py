@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Config читает обязательные настройки при импорте: задаем безопасные значения до импорта модулей бота
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '1:test')
+os.environ.setdefault('TELEGRAM_GROUP_ID', '-1')
+os.environ.setdefault('LABEL_TO_THREAD_MAPPING', '{"INBOX": 1}')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,102 @@
+"""
+Проверка ImapMailSource против локального IMAP-сервера aioimaplib (imap_testing_server):
+поиск, загрузка, пакетная отметка прочитанным и прерывание IDLE другой командой.
+"""
+import asyncio
+import time
+
+from aioimaplib.imap_testing_server import Mail, MockImapServer
+
+from config import Config
+from imap_client import ImapMailSource
+
+USER = 'bot@example.com'
+
+
+def run_with_server(scenario):
+    """Поднимает MockImapServer на свободном порту и выполняет scenario(server, source)"""
+    async def main():
+        server = MockImapServer()
+        listener = await server.run_server(host='127.0.0.1', port=0)
+        saved = {name: getattr(Config, name) for name in (
+            'IMAP_HOST', 'IMAP_PORT', 'IMAP_SSL', 'IMAP_USER', 'IMAP_PASSWORD', 'IMAP_IDLE_MAILBOX', 'IMAP_TIMEOUT'
+        )}
+        Config.IMAP_HOST = '127.0.0.1'
+        Config.IMAP_PORT = listener.sockets[0].getsockname()[1]
+        Config.IMAP_SSL = False
+        Config.IMAP_USER = USER
+        Config.IMAP_PASSWORD = 'password'
+        Config.IMAP_IDLE_MAILBOX = 'INBOX'
+        Config.IMAP_TIMEOUT = 5
+        source = ImapMailSource()
+        try:
+            # Подключаемся заранее: сервер создает ящики пользователя при входе
+            await source.fetch_all(['INBOX'])
+            return await asyncio.wait_for(scenario(server, source), 10)
+        finally:
+            await source._disconnect()
+            listener.close()
+            for name, value in saved.items():
+                setattr(Config, name, value)
+
+    return asyncio.run(main())
+
+
+def deliver(server, subject, content, mailbox='INBOX'):
+    server.receive(Mail.create([USER], mail_from='bank@example.com', subject=subject, content=content), mailbox=mailbox)
+
+
+def flags(server, mailbox='INBOX'):
+    return [mail.flags for mail in server._server_state.mailboxes[USER][mailbox]]
+
+
+def test_fetch_all_and_fetch_message():
+    async def scenario(server, source):
+        deliver(server, 'Платеж', 'Платёж №1 на 100 RUB')
+        deliver(server, 'Выписка', 'Остаток 500 RUB')
+        messages = await source.fetch_all(['INBOX'])
+        assert messages == [{'id': 'INBOX:1'}, {'id': 'INBOX:2'}]
+
+        details = await source.fetch_message('INBOX:2')
+        assert details['id'] == 'INBOX:2'
+        assert details['subject'] == 'Выписка'
+        assert 'Остаток 500 RUB' in details['body']
+        assert details['label_ids'] == ['INBOX']
+        # BODY.PEEK не отмечает письмо прочитанным
+        assert flags(server) == [[], []]
+
+    run_with_server(scenario)
+
+
+def test_acknowledge_many_marks_seen():
+    # STORE тестового сервера понимает только один UID, поэтому пакет - по письму из двух папок
+    async def scenario(server, source):
+        deliver(server, 'Платеж', 'текст')
+        deliver(server, 'Выписка', 'текст')
+        deliver(server, 'Перевод', 'текст', mailbox='Bank')
+        assert await source.acknowledge_many(['INBOX:2', 'Bank:1'])
+        assert flags(server) == [[], ['\\Seen']]
+        assert flags(server, 'Bank') == [['\\Seen']]
+
+    run_with_server(scenario)
+
+
+def test_command_interrupts_idle():
+    async def scenario(server, source):
+        deliver(server, 'Платеж', 'текст')
+        started = time.monotonic()
+        waiting = asyncio.create_task(source.wait_for_mail(3))
+        await asyncio.sleep(0.3)
+
+        # Команда не ждет конца IDLE: соединение освобождается сразу
+        assert await source.acknowledge_many(['INBOX:1'])
+        assert time.monotonic() - started < 1.5
+        assert flags(server) == [['\\Seen']]
+
+        # После команды соединение возвращается в IDLE и просыпается от новой почты
+        await asyncio.sleep(0.3)
+        deliver(server, 'Новое', 'текст')
+        await asyncio.wait_for(waiting, 5)
+        assert time.monotonic() - started < 2.5
+
+    run_with_server(scenario)